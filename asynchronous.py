@@ -0,0 +1,185 @@
+import asyncio
+import contextlib
+import io
+import threading
+import time
+
+from errors import CancelledError, StepLimitError, SyntaxError
+from interpreter import Interpreter
+from limits import Limits
+from parser import Parser, TokenParser
+
+class Turns(Limits):
+    """Limits that make a program take turns with an event loop.
+
+    The program runs in a thread of its own, but only while the loop waits
+    for it: every `every` steps it gives the turn back and waits to be
+    resumed, the way a coroutine stops at an await, so the two never run at
+    the same time. The time spent waiting does not count towards the
+    timeout.
+    """
+
+    def __init__(self, every, max_steps=None, timeout=None, max_depth=None):
+        super().__init__(max_steps, timeout, max_depth)
+        self.every = every
+        self.cancelled = False
+        self.__left = every
+        self.__running = threading.Semaphore(0)
+        self.__waiting = threading.Semaphore(0)
+
+    def start(self):
+        super().start()
+        self.__left = self.every
+
+    def step(self):
+        super().step()
+        self.__left -= 1
+        if (self.__left == 0):
+            self.__left = self.every
+            self.pause()
+
+    def wait(self):
+        # in the program's thread: wait for a turn
+        paused = time.monotonic()
+        self.__running.acquire()
+        self.extend(time.monotonic() - paused)
+        if (self.cancelled):
+            raise CancelledError()
+
+    def pause(self):
+        self.__waiting.release()
+        self.wait()
+
+    def finish(self):
+        self.__waiting.release()
+
+    def resume(self):
+        # on the loop: let the program run until it pauses or finishes
+        self.__running.release()
+        self.__waiting.acquire()
+
+    def cancel(self):
+        # the program stops at its next step and finishes
+        self.cancelled = True
+        self.resume()
+        self.cancelled = False
+
+class AsyncInterpreter:
+    """An Interpreter whose execute can be awaited without stalling the loop.
+
+    Every `every` steps (loop iterations and calls) the program yields to
+    the event loop, so other tasks run between its slices; a slice is
+    bounded like everything between two steps. Cancelling the awaiting
+    task stops the program with a CancelledError at its next step. One
+    execute at a time runs on an AsyncInterpreter, and its environment
+    carries over from one to the next like an Interpreter's.
+    """
+
+    def __init__(self, every=100, **options):
+        # options are passed on to Interpreter; max_steps, timeout and
+        # max_depth go to the Turns that the program's steps go through
+        self.__turns = Turns(every, options.pop('max_steps', None), options.pop('timeout', None), options.pop('max_depth', None))
+        self.interpreter = Interpreter(limits=self.__turns, **options)
+
+    async def execute(self, parse):
+        """Run a parsed program and return its output like Interpreter.execute."""
+        turns = self.__turns
+        outputs = []
+        def run():
+            try:
+                turns.wait()
+                outputs.append(self.interpreter.execute(parse))
+            finally:
+                turns.finish()
+        threading.Thread(target=run, daemon=True).start()
+        try:
+            while True:
+                turns.resume()
+                if (len(outputs) > 0):
+                    return outputs[0]
+                await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            turns.cancel()
+            raise
+
+    def error(self):
+        return self.interpreter.error()
+
+def parse(source, tokens=False):
+    # the parser reports some of its work on stdout
+    parser = TokenParser() if tokens else Parser()
+    with contextlib.redirect_stdout(io.StringIO()):
+        return parser.parse(source, 'program')
+
+async def run_batch(sources, service=None, budget=100000, every=100, concurrency=64, tokens=False, **options):
+    """Run programs concurrently on the loop and return their outputs in order.
+
+    With a service.BatchService, a program still running after budget
+    steps is heavy: it is stopped and, as soon as it is, run again from the
+    start in the service's worker processes, which should have been made
+    with the same options, while the loop goes on. At most concurrency
+    programs run on the loop at once; a heavy one gives up its place while
+    it waits for the workers. Parsing happens on the loop, without
+    yielding, with TokenParser if tokens.
+    """
+    max_steps = options.pop('max_steps', None)
+    inline_steps = max_steps
+    if (service is not None and (max_steps is None or max_steps > budget)):
+        inline_steps = budget
+    slots = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+    async def run(source):
+        async with slots:
+            program = parse(source, tokens)
+            if (program is None):
+                return str(SyntaxError())
+            interpreter = AsyncInterpreter(every, max_steps=inline_steps, **options)
+            output = await interpreter.execute(program)
+            error = interpreter.error()
+        if (inline_steps == max_steps or type(error) is not StepLimitError):
+            return output
+        offloaded = await loop.run_in_executor(None, service.map, [source])
+        return offloaded[0]
+    return list(await asyncio.gather(*(run(source) for source in sources)))
+
+async def _heartbeat(gaps, stop):
+    # records how long the loop took to come back to this task each time
+    last = time.perf_counter()
+    while (not stop.is_set()):
+        await asyncio.sleep(0.001)
+        now = time.perf_counter()
+        gaps.append(now - last)
+        last = now
+
+async def _demo():
+    from service import BatchService
+
+    source = 'var i = 0;\nvar s = 0;\nwhile (i < 100000) {\n  s = s + i * 2 - i / 3;\n  i = i + 1;\n}\nprint s;\n'
+    program = parse(source)
+    for (name, run) in [('blocking', lambda: asyncio.sleep(0, Interpreter().execute(program))), ('async', lambda: AsyncInterpreter().execute(program))]:
+        gaps = []
+        stop = asyncio.Event()
+        heartbeat = asyncio.create_task(_heartbeat(gaps, stop))
+        await asyncio.sleep(0.01)
+        start = time.perf_counter()
+        output = await run()
+        seconds = time.perf_counter() - start
+        stop.set()
+        await heartbeat
+        print('%-8s %s in %.2fs, longest the loop was stalled: %.1fms'%(name, output, seconds, max(gaps) * 1e3))
+    task = asyncio.create_task(AsyncInterpreter().execute(parse('var i = 0;\nwhile (1) {\n  i = i + 1;\n}\n')))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        print('cancelled an endless loop')
+    sources = [source.replace('100000', str(n)) for n in (10, 200000, 30, 40)] + ['print 1 +;']
+    with BatchService(2) as service:
+        print(await run_batch(sources, service, budget=10000))
+
+def main():
+    asyncio.run(_demo())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+import contextlib
+import io
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from interpreter import Interpreter
+from parse import Parse
+from parser import Parser
+from parser_bench import compare
+from transforms import ConstantFoldingTransform
+
+ENGINES = {
+    'tree': {},
+    'resolve': {'resolve': True},
+    'vm': {'vm': True},
+    'native': {'native': True},
+}
+
+def deep_expressions(scale):
+    # nested parentheses on both sides of every operator
+    lines = ['var x = 3;']
+    count = 40 * scale
+    for i in range(count):
+        expression = 'x'
+        for depth in range(12):
+            expression = '(%s %s (%d * x - %d))'%(expression, '+-'[depth % 2], depth + 1, i % 7)
+        lines.append('x = %s / 1000 + 3;'%expression)
+    lines.append('print x;')
+    return ('\n'.join(lines) + '\n', count * 12, 'operators')
+
+def long_loop(scale):
+    count = 20000 * scale
+    source = 'var i = 0;\nvar s = 0;\nwhile (i < %d) {\n  s = s + i * 2 - i / 3;\n  if (s > 1000000) {\n    s = s - 1000000;\n  }\n  i = i + 1;\n}\nprint s;\n'%count
+    return (source, count, 'iterations')
+
+def recursion(scale):
+    n = 14 + scale
+    source = 'var fib = func(n) {\n  if (n < 2) {\n    ret n;\n  }\n  ret fib(n - 1) + fib(n - 2);\n};\nprint fib(%d);\n'%n
+    calls = [1, 1]
+    while (len(calls) <= n):
+        calls.append(calls[-1] + calls[-2] + 1)
+    return (source, calls[n], 'calls')
+
+def closures(scale):
+    count = 5000 * scale
+    source = 'var adder = func(n) {\n  ret func(x) {\n    ret x + n;\n  };\n};\nvar i = 0;\nvar total = 0;\nwhile (i < %d) {\n  var add = adder(i);\n  total = add(total) - i + 1;\n  i = i + 1;\n}\nprint total;\n'%count
+    return (source, count, 'closures')
+
+def large_source(scale):
+    count = 300 * scale
+    lines = ['var acc = 0;', 'var f = func(a, b) { ret a * 2 + b; };']
+    for i in range(count):
+        lines.append('var v%d = (acc + %d) * 3 - f(%d, acc) / 2;'%(i, i, i))
+        lines.append('if (v%d > 10 && !(v%d == 3)) { acc = acc + 1; } else { acc = acc - 1; }'%(i, i))
+        lines.append('print acc; # note %d'%i)
+    return ('\n'.join(lines) + '\n', count * 3, 'statements')
+
+CORPUS = [deep_expressions, long_loop, recursion, closures, large_source]
+
+def corpus(scale=1):
+    """Return name -> (source, units of work, unit name) for every program."""
+    return dict((generate.__name__, generate(scale)) for generate in CORPUS)
+
+def count_nodes(parse):
+    count = 0
+    stack = [parse]
+    while (len(stack) > 0):
+        node = stack.pop()
+        if (isinstance(node, Parse)):
+            count += 1
+            stack.extend(node.children)
+    return count
+
+class Benchmark:
+    """Times parsing, constant folding and interpreting each corpus program.
+
+    Every phase runs repeat times on fresh input and the best time is kept;
+    each phase then runs once more under tracemalloc for its peak memory,
+    so tracing does not slow down the timed runs.
+    """
+
+    def __init__(self, engine='tree', repeat=3, memory=True):
+        self.engine = ENGINES[engine]
+        self.repeat = repeat
+        self.memory = memory
+
+    def __parse(self, source):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return Parser().parse(source, 'program')
+
+    def __transform(self, parse):
+        # the transform reports every step it takes on stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            return ConstantFoldingTransform().visit(parse)
+
+    def __phase(self, run, prepare):
+        best = None
+        for i in range(self.repeat):
+            value = prepare()
+            start = time.perf_counter()
+            run(value)
+            seconds = time.perf_counter() - start
+            best = seconds if best is None else min(best, seconds)
+        peak = None
+        if (self.memory):
+            value = prepare()
+            tracemalloc.start()
+            run(value)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        return (best, peak)
+
+    def run(self, name, source, ops, unit):
+        """Return the results for one program as name/phase/measure -> value."""
+        parse = self.__parse(source)
+        if (parse is None):
+            raise ValueError('benchmark %s does not parse'%name)
+        nodes = count_nodes(parse)
+        phases = [
+            ('parse', lambda value: self.__parse(value), lambda: source, '%.0f bytes/s', len(source)),
+            ('transform', self.__transform, lambda: self.__parse(source), '%.0f nodes/s', nodes),
+            ('interpret', lambda value: Interpreter(**self.engine).execute(value), lambda: parse, '%.0f ' + unit + '/s', ops),
+        ]
+        results = dict()
+        for (phase, run, prepare, throughput, amount) in phases:
+            (seconds, peak) = self.__phase(run, prepare)
+            results['%s/%s/seconds'%(name, phase)] = seconds
+            line = '%-18s %-10s %8.4fs  %s'%(name, phase, seconds, throughput%(amount / seconds))
+            if (phase == 'parse'):
+                line += ', %.0f nodes/s'%(nodes / seconds)
+            if (peak is not None):
+                results['%s/%s/peak'%(name, phase)] = peak
+                line += '  peak %.1fMB'%(peak / 1e6)
+            print(line)
+        return results
+
+def main():
+    # python bench.py [--engine tree|resolve|vm|native] [--scale N] [--repeat N]
+    #     [--no-memory] [--save results.json] [--compare baseline.json]
+    #     [--tolerance 0.1] [--write directory]
+    args = sys.argv[1:]
+    def option(name, default):
+        return args[args.index(name) + 1] if name in args else default
+    programs = corpus(int(option('--scale', 1)))
+    if ('--write' in args):
+        directory = Path(option('--write', '.'))
+        directory.mkdir(parents=True, exist_ok=True)
+        for (name, (source, ops, unit)) in programs.items():
+            directory.joinpath(name + '.lang').write_text(source)
+    benchmark = Benchmark(option('--engine', 'tree'), int(option('--repeat', 3)), '--no-memory' not in args)
+    results = dict()
+    for (name, (source, ops, unit)) in programs.items():
+        results.update(benchmark.run(name, source, ops, unit))
+    if ('--save' in args):
+        with open(option('--save', None), 'w') as file:
+            json.dump(results, file, indent=2)
+    if ('--compare' in args):
+        with open(option('--compare', None)) as file:
+            baseline = json.load(file)
+        slower = compare(results, baseline, float(option('--tolerance', 0.1)))
+        for (name, before, after) in slower:
+            print('regression: %s %.4g -> %.4g'%(name, before, after))
+        if (len(slower) > 0):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import sys
+from pathlib import Path
+
+import irfile
+
+# the modules whose code decides what a program parses and transforms to,
+# and how an entry is stored; changing any of them changes the version and
+# with it every cache key
+_GRAMMAR_MODULES = ('parser.py', 'lexer.py', 'parse.py', 'sexp.py', 'transforms.py', 'irfile.py')
+
+def grammar_version():
+    digest = hashlib.sha256()
+    for name in _GRAMMAR_MODULES:
+        digest.update(Path(__file__).with_name(name).read_bytes())
+    return digest.hexdigest()[:16]
+
+class CompileCache:
+    """Content-addressed directory of parsed programs.
+
+    An entry is keyed by the hash of the program source, the grammar
+    version and the names of the transforms applied after parsing, and
+    holds the tree in the irfile binary format (or nothing for a program
+    with a syntax error). Entries are never updated in place: a changed
+    program or grammar simply has a different key, and clear() drops them
+    all.
+    """
+
+    MISS = object() # get() found no entry; None is a cached syntax error
+    SUFFIX = '.lir'
+
+    def __init__(self, directory, version=None):
+        self.directory = Path(directory)
+        self.version = version if version is not None else grammar_version()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+
+    def key(self, source, transforms=()):
+        digest = hashlib.sha256()
+        digest.update(self.version.encode())
+        digest.update(('\0'.join(transforms) + '\0\0').encode())
+        digest.update(source.encode())
+        return digest.hexdigest()
+
+    def __path(self, key):
+        return self.directory.joinpath(key[:2], key[2:] + CompileCache.SUFFIX)
+
+    def get(self, source, transforms=()):
+        try:
+            data = self.__path(self.key(source, transforms)).read_bytes()
+        except FileNotFoundError:
+            self.misses += 1
+            return CompileCache.MISS
+        self.hits += 1
+        if (len(data) == 0):
+            return None
+        return irfile.Reader(data).to_parse()
+
+    def put(self, source, parse, transforms=()):
+        path = self.__path(self.key(source, transforms))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = b'' if parse is None else irfile.dumps(parse)
+        # written under a temporary name and renamed, so a reader never
+        # sees half an entry
+        temporary = path.with_name('%s.%d.tmp'%(path.name, os.getpid()))
+        temporary.write_bytes(data)
+        os.replace(temporary, path)
+        self.writes += 1
+
+    def parse(self, source, parse, transforms=()):
+        """Return the cached tree for source, calling parse() to make it on a miss.
+
+        transforms are (name, function) pairs applied in order to the parse.
+        """
+        names = tuple(name for (name, transform) in transforms)
+        result = self.get(source, names)
+        if (result is not CompileCache.MISS):
+            return result
+        result = parse()
+        if (result is not None):
+            for (name, transform) in transforms:
+                result = transform(result)
+        self.put(source, result, names)
+        return result
+
+    def entries(self):
+        if (not self.directory.is_dir()):
+            return []
+        return sorted(self.directory.glob('*/*' + CompileCache.SUFFIX))
+
+    def clear(self):
+        """Remove every entry and return how many there were."""
+        removed = 0
+        for path in self.entries():
+            path.unlink()
+            removed += 1
+        if (self.directory.is_dir()):
+            for directory in self.directory.iterdir():
+                if (directory.is_dir() and not any(directory.iterdir())):
+                    directory.rmdir()
+        return removed
+
+    def report(self):
+        lookups = self.hits + self.misses
+        rate = 100 * self.hits / lookups if lookups > 0 else 0
+        return 'cache: %d hits, %d misses (%.0f%% hit rate), %d written'%(self.hits, self.misses, rate, self.writes)
+
+def main():
+    # python cache.py (stats|clear) [directory]
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    cache = CompileCache(sys.argv[2] if len(sys.argv) > 2 else '.langcache')
+    if (command == 'clear'):
+        print('removed %d entries from %s'%(cache.clear(), cache.directory))
+    elif (command == 'stats'):
+        entries = cache.entries()
+        size = sum(path.stat().st_size for path in entries)
+        print('%s: %d entries, %d bytes, grammar version %s'%(cache.directory, len(entries), size, cache.version))
+    else:
+        print('unknown command %s, expected stats or clear'%command)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
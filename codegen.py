@@ -0,0 +1,456 @@
+import errors
+from closure import Closure
+from compiler import Compiler
+from parse import Parse
+from resolver import Resolver, declarations
+
+def _type(value):
+    if (isinstance(value, Closure)):
+        return 'func'
+    return 'int'
+
+class Frame:
+    def __init__(self, name, types, declared=0, function=False):
+        self.name = name # the Python variable holding the environment's values
+        self.types = types # the declared type of every slot
+        self.declared = declared # how many slots are declared at the current point
+        self.function = function
+
+class CodeGenerator:
+    """Translates a program into Python source and compiles it with compile().
+
+    The program is resolved first, so every environment becomes a Python
+    list indexed by slot and a declaration appends to it. Function
+    expressions become nested defs that receive the lists of their
+    enclosing environments as default arguments, which captures them the
+    way a Closure captures its environment. Operators, calls and
+    declarations check their operands inline and raise the same errors in
+    the same order as Interpreter; each call is one Python call, so
+    recursion is bounded by Python's recursion limit.
+    """
+
+    ARITHMETIC = { 'add': '+', 'sub': '-', 'mul': '*' }
+    COMPARISONS = { 'lt': '<', 'gt': '>', 'leq': '<=', 'geq': '>=', 'eq': '==', 'neq': '!=' }
+
+    def __init__(self, environment, limits=None):
+        self.__environment = environment
+        # with a limits.Limits every loop iteration and call counts a step;
+        # without one the generated code has no step calls at all
+        self.__limits = limits
+        self.__lines = []
+        self.__indent = 0
+        self.__temps = 0
+        self.__stack = []
+        self.__elided = False
+        self.__whiles = []
+        self.__function = None
+        self.__returning = None
+
+    def source(self, parse):
+        """Return the Python source of a def program(out, environment)."""
+        parse = Resolver(self.__environment).resolve(parse)
+        names = self.__environment.names()
+        frame = Frame('s0', list(self.__environment.types()), len(names))
+        self.__slot_types(parse, frame)
+        self.__lines = []
+        self.__indent = 0
+        self.__stack = [frame]
+        self._line('def program(out, environment):')
+        self.__indent += 1
+        self._line('s0 = environment.values()')
+        self._statement(parse)
+        self._line('return')
+        return '\n'.join(self.__lines) + '\n'
+
+    def compile(self, parse):
+        """Return a function that runs the program, given a function to print with.
+
+        Returns None when Python cannot compile the source, which happens
+        to blocks nested deeper than its parser or compiler allows.
+        """
+        namespace = dict((name, value) for (name, value) in vars(errors).items() if (not name.startswith('__')))
+        namespace['Closure'] = Closure
+        namespace['_type'] = _type
+        if (self.__limits is not None):
+            namespace['step'] = self.__limits.step
+        try:
+            code = compile(self.source(parse), '<lang>', 'exec')
+        except (SyntaxError, RecursionError, MemoryError):
+            return None
+        exec(code, namespace)
+        program = namespace['program']
+        environment = self.__environment
+        return lambda out: program(out, environment)
+
+    def _line(self, line):
+        self.__lines.append('    '*self.__indent + line)
+
+    def _temp(self):
+        self.__temps += 1
+        return 't%d'%self.__temps
+
+    def __slot_types(self, body, frame):
+        statements = [body]
+        if (isinstance(body, Parse) and body.type == 'sequence'):
+            statements = body.children
+        for statement in statements:
+            if (isinstance(statement, Parse) and statement.type == 'slot_declare'):
+                (type, var, slot, value) = statement.children
+                if (slot == len(frame.types)):
+                    frame.types.append(type)
+
+    def __check_type(self, type, value):
+        # raise TypeMismatchError unless value has the type a declaration or signature asks for
+        if (type == 'var'):
+            return
+        if (type == 'int'):
+            self._line('if ((%s).__class__ is Closure):'%value)
+        elif (type == 'func'):
+            self._line('if ((%s).__class__ is not Closure):'%value)
+        else:
+            self._line('if (_type(%s) != %r):'%(value, type))
+        self._line('    raise TypeMismatchError()')
+
+    def __candidates(self, addresses):
+        # (frame, slot, declared for sure) for each address, innermost first
+        candidates = []
+        for (depth, slot) in addresses:
+            frame = self.__stack[-1 - depth]
+            candidates.append((frame, slot, slot < frame.declared))
+            if (slot < frame.declared):
+                break
+        return candidates
+
+    def _block(self, body):
+        if (len(declarations(body)) == 0):
+            elided = self.__elided
+            self.__elided = True
+            self._statement(body)
+            self.__elided = elided
+            return
+        frame = Frame('s%d'%len(self.__stack), [])
+        self.__slot_types(body, frame)
+        self._line('%s = []'%frame.name)
+        self.__stack.append(frame)
+        elided = self.__elided
+        self.__elided = False
+        self._statement(body)
+        self.__elided = elided
+        self.__stack.pop()
+
+    def _statement(self, parse):
+        if (not isinstance(parse, Parse)):
+            return
+        generator = getattr(self, '_statement_%s'%parse.type, None)
+        if (not callable(generator)):
+            self._expression(parse)
+            return
+        generator(parse)
+
+    def _statement_sequence(self, parse):
+        for statement in parse.children:
+            self._statement(statement)
+
+    def _statement_print(self, parse):
+        self._line('out(%s)'%self._expression(parse.children[0]))
+
+    def _statement_slot_declare(self, parse):
+        (type, var, slot, value) = parse.children
+        value = self._expression(value)
+        frame = self.__stack[-1]
+        if (slot < frame.declared):
+            self._line('raise VariableAlreadyDefinedError()')
+            return
+        frame.declared += 1
+        self.__check_type(type, value)
+        if (len(self.__stack) == 1):
+            # the global environment is kept as an ArrayEnvironment for later runs
+            self._line('environment.declare(%r, %s, %r)'%(var, value, type))
+        else:
+            self._line('%s.append(%s)'%(frame.name, value))
+
+    def _statement_assign(self, parse):
+        (location, value) = parse.children
+        value = self._expression(value)
+        if (not (isinstance(location, Parse) and location.type == 'slot_varloc')):
+            # anything else evaluates to a Pointer, written like Interpreter does
+            pointer = self._temp()
+            self._line('%s = %s'%(pointer, self._expression(location)))
+            type = self._temp()
+            self._line('%s = %s.type()'%(type, pointer))
+            self._line("if (%s not in ('var', _type(%s))):"%(type, value))
+            self._line('    raise TypeMismatchError()')
+            self._line('%s.set(%s)'%(pointer, value))
+            return
+        keyword = 'if'
+        for (frame, slot, declared) in self.__candidates(location.children[1]):
+            if (declared):
+                if (keyword != 'if'):
+                    self._line('else:')
+                    self.__indent += 1
+                self.__check_type(frame.types[slot], value)
+                self._line('%s[%d] = %s'%(frame.name, slot, value))
+                if (keyword != 'if'):
+                    self.__indent -= 1
+                return
+            self._line('%s (len(%s) > %d):'%(keyword, frame.name, slot))
+            self.__indent += 1
+            self.__check_type(frame.types[slot], value)
+            self._line('%s[%d] = %s'%(frame.name, slot, value))
+            self.__indent -= 1
+            keyword = 'elif'
+        if (keyword != 'if'):
+            self._line('else:')
+            self.__indent += 1
+        self._line('raise UndefinedVariableError()')
+        if (keyword != 'if'):
+            self.__indent -= 1
+
+    def _statement_while(self, parse):
+        (cond, body) = parse.children
+        self._line('while True:')
+        self.__indent += 1
+        self._line('if (%s == 0):'%self._expression(cond))
+        self._line('    break')
+        if (self.__limits is not None):
+            self._line('step()')
+        self.__whiles.append((cond, list(self.__stack), self.__elided))
+        self._block(body)
+        self.__whiles.pop()
+        self.__indent -= 1
+
+    def _statement_if(self, parse):
+        (cond, body) = parse.children
+        self._line('if (%s != 0):'%self._expression(cond))
+        self.__indent += 1
+        self._block(body)
+        self._line('pass')
+        self.__indent -= 1
+
+    def _statement_ifelse(self, parse):
+        (cond, body_if, body_else) = parse.children
+        self._line('if (%s != 0):'%self._expression(cond))
+        self.__indent += 1
+        self._block(body_if)
+        self._line('pass')
+        self.__indent -= 1
+        self._line('else:')
+        self.__indent += 1
+        self._block(body_else)
+        self._line('pass')
+        self.__indent -= 1
+
+    def _statement_return(self, parse):
+        if (self.__function is None):
+            self._line('raise IllegalReturnError()')
+            return
+        value = self._expression(parse.children[0])
+        # Interpreter tests every enclosing loop condition once more after a
+        # ret, looking variables up only in the loop's own environment
+        stack = self.__stack
+        for (cond, loop_stack, elided) in reversed(self.__whiles):
+            self.__stack = loop_stack
+            self.__returning = elided
+            self._expression(cond)
+        self.__stack = stack
+        self.__returning = None
+        self.__check_type(self.__function, value)
+        self._line('return %s'%value)
+
+    def _expression(self, parse):
+        if (not isinstance(parse, Parse)):
+            return repr(parse)
+        name = Compiler.RENAMED_TYPES.get(parse.type, parse.type)
+        if (name in CodeGenerator.ARITHMETIC or name == 'div'):
+            return self._arithmetic(name, parse)
+        if (name in CodeGenerator.COMPARISONS):
+            return self._comparison(name, parse)
+        generator = getattr(self, '_expression_%s'%name, None)
+        if (not callable(generator)):
+            self._line('raise RuntimeError()')
+            return 'None'
+        return generator(parse)
+
+    def _arithmetic(self, name, parse):
+        (operandA, operandB) = parse.children
+        a = self._expression(operandA)
+        b = self._expression(operandB)
+        result = self._temp()
+        checks = ['%s.__class__ is Closure'%operand for (operand, child) in ((a, operandA), (b, operandB)) if (isinstance(child, Parse))]
+        if (len(checks) > 0):
+            self._line('if (%s):'%' or '.join(checks))
+            self._line('    raise MathOperationOnFunctionError()')
+        if (name == 'div'):
+            self._line('if (%s == 0):'%b)
+            self._line('    raise DivideByZeroError()')
+            self._line('%s = int(%s / %s)'%(result, a, b))
+        else:
+            self._line('%s = %s %s %s'%(result, a, CodeGenerator.ARITHMETIC[name], b))
+        return result
+
+    def _comparison(self, name, parse):
+        (operandA, operandB) = parse.children
+        a = self._expression(operandA)
+        b = self._expression(operandB)
+        result = self._temp()
+        operator = CodeGenerator.COMPARISONS[name]
+        checks = ['%s.__class__ is not int'%operand for (operand, child) in ((a, operandA), (b, operandB)) if (isinstance(child, Parse))]
+        # a function is never identical to a literal
+        same = '%s is %s'%(a, b) if (len(checks) == 2) else 'False'
+        if (len(checks) > 0):
+            self._line('if (%s):'%' or '.join(checks))
+            if (name == 'eq'):
+                self._line('    %s = 1 if %s else 0'%(result, same))
+            elif (name == 'neq'):
+                self._line('    %s = 0 if %s else 1'%(result, same))
+            else:
+                self._line('    raise MathOperationOnFunctionError()')
+            self._line('else:')
+            self._line('    %s = 1 if %s %s %s else 0'%(result, a, operator, b))
+        else:
+            self._line('%s = 1 if %s %s %s else 0'%(result, a, operator, b))
+        return result
+
+    def _expression_not(self, parse):
+        value = self._expression(parse.children[0])
+        result = self._temp()
+        self._line('%s = 0 if %s != 0 else 1'%(result, value))
+        return result
+
+    def _expression_and(self, parse):
+        (operandA, operandB) = parse.children
+        result = self._temp()
+        self._line('%s = 0'%result)
+        self._line('if (%s != 0):'%self._expression(operandA))
+        self.__indent += 1
+        self._line('if (%s != 0):'%self._expression(operandB))
+        self._line('    %s = 1'%result)
+        self.__indent -= 1
+        return result
+
+    def _expression_or(self, parse):
+        (operandA, operandB) = parse.children
+        result = self._temp()
+        self._line('%s = 1'%result)
+        self._line('if (%s == 0):'%self._expression(operandA))
+        self.__indent += 1
+        self._line('if (%s == 0):'%self._expression(operandB))
+        self._line('    %s = 0'%result)
+        self.__indent -= 1
+        return result
+
+    def _expression_slot_lookup(self, parse):
+        (var, addresses) = parse.children
+        if (self.__returning is not None):
+            # a loop condition after a ret, see Interpreter._eval_lookup
+            if (self.__returning or len(addresses) == 0 or addresses[0][0] != 0):
+                self._line('raise UndefinedVariableError()')
+                return 'None'
+            frame = self.__stack[-1]
+            slot = addresses[0][1]
+            result = self._temp()
+            if (slot >= frame.declared):
+                self._line('if (len(%s) <= %d):'%(frame.name, slot))
+                self._line('    raise UndefinedVariableError()')
+            self._line('%s = %s[%d]'%(result, frame.name, slot))
+            return result
+        result = self._temp()
+        keyword = 'if'
+        for (frame, slot, declared) in self.__candidates(addresses):
+            if (declared):
+                if (keyword == 'if'):
+                    self._line('%s = %s[%d]'%(result, frame.name, slot))
+                else:
+                    self._line('else:')
+                    self._line('    %s = %s[%d]'%(result, frame.name, slot))
+                return result
+            self._line('%s (len(%s) > %d):'%(keyword, frame.name, slot))
+            self._line('    %s = %s[%d]'%(result, frame.name, slot))
+            keyword = 'elif'
+        if (keyword == 'if'):
+            self._line('raise UndefinedVariableError()')
+        else:
+            self._line('else:')
+            self._line('    raise UndefinedVariableError()')
+        return result
+
+    def _expression_function(self, parse):
+        params = parse.children[0]
+        body = parse.children[1]
+        if (len(parse.children) == 3):
+            (signature, params, body) = parse.children
+            signature = tuple(signature.children)
+        else:
+            signature = ('var',) * (len(params.children) + 1)
+        params = tuple(params.children)
+        if (len(params) != len(set(params))):
+            self._line('raise DuplicateParameterError()')
+            return 'None'
+
+        name = 'f%d'%self.__temps
+        self.__temps += 1
+        frame = Frame('s%d'%len(self.__stack), list(signature[:-1]), len(params), True)
+        self.__slot_types(body, frame)
+        arguments = ['p%d'%i for i in range(len(params))]
+        captured = ['%s=%s'%(outer.name, outer.name) for outer in self.__stack]
+        self._line('def %s(%s):'%(name, ', '.join(arguments + captured)))
+        self.__indent += 1
+        if (self.__limits is not None):
+            self._line('step()')
+        self._line('%s = [%s]'%(frame.name, ', '.join(arguments)))
+        outer = (self.__stack, self.__elided, self.__whiles, self.__function, self.__returning)
+        self.__stack = self.__stack + [frame]
+        self.__elided = False
+        self.__whiles = []
+        self.__function = signature[-1]
+        self.__returning = None
+        self._statement(body)
+        self.__check_type(self.__function, '0')
+        self._line('return 0')
+        (self.__stack, self.__elided, self.__whiles, self.__function, self.__returning) = outer
+        self.__indent -= 1
+
+        result = self._temp()
+        self._line('%s = Closure(%r, %s, None, %r)'%(result, params, name, signature))
+        return result
+
+    def _expression_call(self, parse):
+        (callee, args) = parse.children
+        closure = self._expression(callee)
+        self._line('if (%s.__class__ is not Closure):'%closure)
+        self._line('    raise CallingNonFunctionError()')
+        self._line('if (len(%s.params()) != %d):'%(closure, len(args.children)))
+        self._line('    raise ArgumentMismatchError()')
+        values = []
+        if (len(args.children) > 0):
+            signature = self._temp()
+            self._line('%s = %s.signature()'%(signature, closure))
+        for (index, arg) in enumerate(args.children):
+            value = self._expression(arg)
+            self._line("if (%s[%d] != 'var' and %s[%d] != _type(%s)):"%(signature, index, signature, index, value))
+            self._line('    raise TypeMismatchError()')
+            values.append(value)
+        result = self._temp()
+        self._line('%s = %s.body()(%s)'%(result, closure, ', '.join(values)))
+        return result
+
+def main():
+    import time
+    from environment import ArrayEnvironment
+    from interpreter import Interpreter
+    from parser import Parser
+
+    source = 'var fib = func(int n) -> int { if (n < 2) { ret n; } ret fib(n - 1) + fib(n - 2); };\nvar i = 0;\nvar total = 0;\nwhile (i < 20000) {\n  total = total + i * 3 / 2 - i;\n  i = i + 1;\n}\nprint total;\nprint fib(18);\n'
+    parse = Parser().parse(source, 'program')
+    print(CodeGenerator(ArrayEnvironment()).source(parse))
+    for (name, options) in (('tree', {}), ('vm', {'vm': True}), ('native', {'native': True})):
+        start = time.perf_counter()
+        output = Interpreter(**options).execute(parse)
+        print('%-6s %.3fs %s'%(name, time.perf_counter() - start, output.split()))
+    # Python compiles at most 20 nested loops, so this one runs on the tree
+    parse = Parser().parse('var i = 0;\n' + 'while (i < 1) {\n'*30 + 'i = i + 1;\n' + '}\n'*30 + 'print i;\n', 'program')
+    for (name, options) in (('tree', {}), ('vm', {'vm': True}), ('native', {'native': True})):
+        print('%-6s %s'%(name, Interpreter(**options).execute(parse).split()))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,272 @@
+from errors import *
+from parse import Parse
+
+# Opcodes. Code is a flat list of (opcode, argument) pairs.
+CONST = 0          # push argument
+LOOKUP = 1         # push the value of variable argument
+DECLARE = 2        # pop a value and declare it as argument (name, type)
+ASSIGN = 3         # pop a value and assign it to variable argument
+ASSIGN_POINTER = 4 # pop a pointer then a value and assign through the pointer
+VARLOC = 5         # push a pointer to variable argument
+POP = 6            # discard the top of the stack
+PRINT = 7          # pop a value and print it
+ADD = 8
+SUB = 9
+MUL = 10
+DIV = 11
+LT = 12
+GT = 13
+LEQ = 14
+GEQ = 15
+EQ = 16
+NEQ = 17
+NOT = 18
+JUMP = 19          # continue at argument
+JUMP_IF_FALSE = 20 # pop a value and continue at argument if it is 0
+JUMP_IF_TRUE = 21  # pop a value and continue at argument if it is truthy
+PUSH_SCOPE = 22    # enter a new block environment
+POP_SCOPE = 23     # leave the current block environment
+FUNCTION = 24      # push a closure over the current environment for Code argument
+CHECK_CALL = 25    # check the callee below argument arguments can be called with them
+ARG = 26           # type check the value on top against parameter argument
+CALL = 27          # call with argument arguments
+SET_RETURN = 28    # pop the return value and mark the frame as returning
+RETURN = 29        # leave the function with its return value
+RAISE = 30         # raise the error class argument
+HALT = 31
+LOOP = 32          # like JUMP_IF_FALSE, but going on starts a loop iteration
+
+NAMES = ['CONST', 'LOOKUP', 'DECLARE', 'ASSIGN', 'ASSIGN_POINTER', 'VARLOC', 'POP', 'PRINT', 'ADD', 'SUB', 'MUL', 'DIV', 'LT', 'GT', 'LEQ', 'GEQ', 'EQ', 'NEQ', 'NOT', 'JUMP', 'JUMP_IF_FALSE', 'JUMP_IF_TRUE', 'PUSH_SCOPE', 'POP_SCOPE', 'FUNCTION', 'CHECK_CALL', 'ARG', 'CALL', 'SET_RETURN', 'RETURN', 'RAISE', 'HALT', 'LOOP']
+
+class Code:
+    def __init__(self, params=(), signature=(), duplicate=False):
+        self.instructions = []
+        self.params = params
+        self.signature = signature
+        self.duplicate = duplicate # raise DuplicateParameterError when the closure is made
+
+    def __str__(self):
+        lines = []
+        for pc in range(0, len(self.instructions), 2):
+            lines.append('%4d %s %s'%(pc, NAMES[self.instructions[pc]], self.instructions[pc + 1]))
+        return '\n'.join(lines)
+
+class Compiler:
+    """Compiles Parse trees into Code for the VM.
+
+    Every statement and expression compiles to the instructions that
+    reproduce what Interpreter._exec and Interpreter._eval do for it,
+    including the order values are evaluated and errors are raised.
+    """
+
+    RENAMED_TYPES = { '+':'add', '-': 'sub', '*': 'mul', '/': 'div', '||': 'or', '&&': 'and', '!':'not', '<':'lt', '>': 'gt', '<=': 'leq', '>=': 'geq', '==': 'eq', '!=': 'neq'}
+    OPERATORS = { 'add': ADD, 'sub': SUB, 'mul': MUL, 'div': DIV, 'lt': LT, 'gt': GT, 'leq': LEQ, 'geq': GEQ, 'eq': EQ, 'neq': NEQ }
+
+    def __init__(self):
+        self.__code = None
+        self.__in_function = False
+        self.__scopes = 0
+        self.__whiles = []
+
+    def compile(self, parse):
+        self.__code = Code()
+        self.__in_function = False
+        self.__scopes = 0
+        self.__whiles = []
+        self._statement(parse)
+        self._emit(HALT)
+        return self.__code
+
+    def _emit(self, op, arg=None):
+        self.__code.instructions.append(op)
+        self.__code.instructions.append(arg)
+        return len(self.__code.instructions) - 1
+
+    def _here(self):
+        return len(self.__code.instructions)
+
+    def _patch(self, position, target):
+        self.__code.instructions[position] = target
+
+    def _statement(self, parse):
+        if (not isinstance(parse, Parse)):
+            return
+        compiler = getattr(self, '_statement_%s'%parse.type, None)
+        if (not callable(compiler)):
+            self._expression(parse)
+            self._emit(POP)
+            return
+        compiler(parse)
+
+    def _expression(self, parse):
+        if (not isinstance(parse, Parse)):
+            self._emit(CONST, parse)
+            return
+        name = Compiler.RENAMED_TYPES.get(parse.type, parse.type)
+        if (name in Compiler.OPERATORS):
+            (operandA, operandB) = parse.children
+            self._expression(operandA)
+            self._expression(operandB)
+            self._emit(Compiler.OPERATORS[name])
+            return
+        compiler = getattr(self, '_expression_%s'%name, None)
+        if (not callable(compiler)):
+            self._emit(RAISE, RuntimeError)
+            return
+        compiler(parse)
+
+    def _block(self, body):
+        self._emit(PUSH_SCOPE)
+        self.__scopes += 1
+        self._statement(body)
+        self.__scopes -= 1
+        self._emit(POP_SCOPE)
+
+    def _statement_print(self, parse):
+        self._expression(parse.children[0])
+        self._emit(PRINT)
+
+    def _statement_sequence(self, parse):
+        for statement in parse.children:
+            self._statement(statement)
+
+    def _statement_declare(self, parse):
+        type = 'var'
+        nameIndex = 0
+        if (len(parse.children) == 3):
+            type = parse.children[0]
+            nameIndex += 1
+        self._expression(parse.children[nameIndex + 1])
+        self._emit(DECLARE, (parse.children[nameIndex], type))
+
+    def _statement_assign(self, parse):
+        (location, value) = parse.children
+        self._expression(value)
+        if (isinstance(location, Parse) and location.type == 'varloc'):
+            self._emit(ASSIGN, location.children[0])
+        else:
+            self._expression(location)
+            self._emit(ASSIGN_POINTER)
+
+    def _statement_while(self, parse):
+        (cond, body) = parse.children
+        start = self._here()
+        self._expression(cond)
+        exit = self._emit(LOOP)
+        self.__whiles.append((cond, self.__scopes))
+        self._block(body)
+        self.__whiles.pop()
+        self._emit(JUMP, start)
+        self._patch(exit, self._here())
+
+    def _statement_if(self, parse):
+        (cond, body) = parse.children
+        self._expression(cond)
+        exit = self._emit(JUMP_IF_FALSE)
+        self._block(body)
+        self._patch(exit, self._here())
+
+    def _statement_ifelse(self, parse):
+        (cond, body_if, body_else) = parse.children
+        self._expression(cond)
+        otherwise = self._emit(JUMP_IF_FALSE)
+        self._block(body_if)
+        exit = self._emit(JUMP)
+        self._patch(otherwise, self._here())
+        self._block(body_else)
+        self._patch(exit, self._here())
+
+    def _statement_return(self, parse):
+        if (not self.__in_function):
+            self._emit(RAISE, IllegalReturnError)
+            return
+        self._expression(parse.children[0])
+        self._emit(SET_RETURN)
+        # Interpreter._exec_while tests its condition once more after its body
+        # returns, so every enclosing loop condition is evaluated on the way out
+        scopes = self.__scopes
+        for (cond, depth) in reversed(self.__whiles):
+            for i in range(scopes - depth):
+                self._emit(POP_SCOPE)
+            scopes = depth
+            self._expression(cond)
+            self._emit(POP)
+        self._emit(RETURN)
+
+    def _expression_lookup(self, parse):
+        self._emit(LOOKUP, parse.children[0])
+
+    def _expression_varloc(self, parse):
+        self._emit(VARLOC, parse.children[0])
+
+    def _expression_not(self, parse):
+        self._expression(parse.children[0])
+        self._emit(NOT)
+
+    def _expression_and(self, parse):
+        (operandA, operandB) = parse.children
+        self._expression(operandA)
+        falseA = self._emit(JUMP_IF_FALSE)
+        self._expression(operandB)
+        falseB = self._emit(JUMP_IF_FALSE)
+        self._emit(CONST, 1)
+        exit = self._emit(JUMP)
+        self._patch(falseA, self._here())
+        self._patch(falseB, self._here())
+        self._emit(CONST, 0)
+        self._patch(exit, self._here())
+
+    def _expression_or(self, parse):
+        (operandA, operandB) = parse.children
+        self._expression(operandA)
+        trueA = self._emit(JUMP_IF_TRUE)
+        self._expression(operandB)
+        trueB = self._emit(JUMP_IF_TRUE)
+        self._emit(CONST, 0)
+        exit = self._emit(JUMP)
+        self._patch(trueA, self._here())
+        self._patch(trueB, self._here())
+        self._emit(CONST, 1)
+        self._patch(exit, self._here())
+
+    def _expression_function(self, parse):
+        params = parse.children[0]
+        body = parse.children[1]
+        if (len(parse.children) == 3):
+            (signature, params, body) = parse.children
+            signature = list(signature.children)
+        else:
+            signature = ['var'] * (len(params.children) + 1)
+        params = list(params.children)
+        code = Code(params, signature, len(params) != len(set(params)))
+
+        outer = (self.__code, self.__in_function, self.__scopes, self.__whiles)
+        self.__code = code
+        self.__in_function = True
+        self.__scopes = 0
+        self.__whiles = []
+        self._statement(body)
+        self._emit(RETURN)
+        (self.__code, self.__in_function, self.__scopes, self.__whiles) = outer
+
+        self._emit(FUNCTION, code)
+
+    def _expression_call(self, parse):
+        (callee, args) = parse.children
+        self._expression(callee)
+        self._emit(CHECK_CALL, len(args.children))
+        for (index, arg) in enumerate(args.children):
+            self._expression(arg)
+            self._emit(ARG, index)
+        self._emit(CALL, len(args.children))
+
+def main():
+    from sexp import sexp
+    program = sexp('(sequence (declare f (function (parameters n) (sequence (while (lookup n) (sequence (return (lookup n))))))) (print (call (lookup f) (arguments 3))))')
+    code = Compiler().compile(program)
+    print(code)
+    print('function:')
+    print(code.instructions[1])
+
+if __name__ == '__main__':
+    main()
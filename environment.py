@@ -10,14 +10,101 @@ class Environment:
     def get_parent(self):
         return self.__parent
 
+    def clear(self):
+        self.__variables.clear()
+
     def contains(self, var):
         return var in self.__variables
 
     def set(self, var, value, varType):
         self.__variables[var] = [value,varType]
 
+    def snapshot(self):
+        # set replaces a variable's entry instead of changing it, so a copy
+        # of the dict is enough
+        return dict(self.__variables)
+
+    def restore(self, snapshot):
+        self.__variables.clear()
+        self.__variables.update(snapshot)
+
     def get(self, var):
         return self.__variables[var][0]
 
     def get_type(self, var):
         return self.__variables[var][1]
+
+class ArrayEnvironment:
+    """Environment whose variables are numbered in the order they are declared.
+
+    Resolver gives every declaration a slot, which is its position in that
+    order, so the interpreter can read and write variables by index and
+    slot < size() tells whether a declaration has happened yet. The name
+    based methods make it usable anywhere an Environment is.
+    """
+
+    def __init__(self, parent=None):
+        self.__parent = parent
+        self.__names = []
+        self.__values = []
+        self.__types = []
+
+    def __str__(self):
+        return str(dict(zip(self.__names, ([value, type] for (value, type) in zip(self.__values, self.__types)))))
+
+    def get_parent(self):
+        return self.__parent
+
+    def names(self):
+        return self.__names
+
+    def values(self):
+        return self.__values
+
+    def types(self):
+        return self.__types
+
+    def clear(self):
+        del self.__names[:]
+        del self.__values[:]
+        del self.__types[:]
+
+    def size(self):
+        return len(self.__values)
+
+    def snapshot(self):
+        return (list(self.__names), list(self.__values), list(self.__types))
+
+    def restore(self, snapshot):
+        # in place, since compiled code holds on to the lists
+        (self.__names[:], self.__values[:], self.__types[:]) = snapshot
+
+    def declare(self, var, value, varType):
+        self.__names.append(var)
+        self.__values.append(value)
+        self.__types.append(varType)
+
+    def get_slot(self, slot):
+        return self.__values[slot]
+
+    def get_slot_type(self, slot):
+        return self.__types[slot]
+
+    def set_slot(self, slot, value, varType):
+        self.__values[slot] = value
+        self.__types[slot] = varType
+
+    def contains(self, var):
+        return var in self.__names
+
+    def set(self, var, value, varType):
+        if (var in self.__names):
+            self.set_slot(self.__names.index(var), value, varType)
+        else:
+            self.declare(var, value, varType)
+
+    def get(self, var):
+        return self.__values[self.__names.index(var)]
+
+    def get_type(self, var):
+        return self.__types[self.__names.index(var)]
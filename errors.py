@@ -45,3 +45,25 @@ class DuplicateParameterError(RuntimeError):
 class TypeMismatchError(RuntimeError):
     def __str__(self):
         return "runtime error: type mismatch"
+
+class StepLimitError(RuntimeError):
+    def __init__(self, steps):
+        self.steps = steps # loop iterations and calls run before stopping
+
+    def __str__(self):
+        return "runtime error: step limit exceeded after %d steps"%self.steps
+
+class TimeLimitError(StepLimitError):
+    def __str__(self):
+        return "runtime error: time limit exceeded after %d steps"%self.steps
+
+class CancelledError(RuntimeError):
+    def __str__(self):
+        return "runtime error: cancelled"
+
+class CallDepthError(RuntimeError):
+    def __init__(self, depth):
+        self.depth = depth # calls open when it stopped, 0 where not counted
+
+    def __str__(self):
+        return "runtime error: call depth limit exceeded"
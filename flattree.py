@@ -0,0 +1,166 @@
+import marshal
+import sys
+from array import array
+
+from parse import Parse
+
+class FlatTree:
+    """A Parse tree stored in a few flat arrays instead of one object per node.
+
+    Node n has kind kinds[n] and index indexes[n]; its children are
+    children[starts[n]:starts[n] + counts[n]], where a number >= 0 is
+    another node and -1 - i is leaves[i]. Nodes are numbered breadth
+    first from the root, which is node 0.
+    """
+
+    # marks the bytes written by to_bytes; the arrays are in native byte order
+    MAGIC = b'FLAT1' + sys.byteorder[0].encode()
+
+    def __init__(self, parse=None):
+        self.kinds = array('H')
+        self.indexes = array('q')
+        self.starts = array('q')
+        self.counts = array('q')
+        self.children = array('q')
+        self.leaves = []
+        # one view per node, so a node reads as the same object every time
+        # and caches keyed by id() keep working
+        self.__views = dict()
+        if (parse is None):
+            return
+        self.__add(parse)
+        queue = [parse]
+        position = 0
+        while (position < len(queue)):
+            node = queue[position]
+            self.starts[position] = len(self.children)
+            for child in node.children:
+                if (isinstance(child, Parse)):
+                    self.children.append(self.__add(child))
+                    queue.append(child)
+                else:
+                    self.children.append(-1 - len(self.leaves))
+                    self.leaves.append(child)
+            queue[position] = None
+            position += 1
+
+    def __add(self, parse):
+        self.kinds.append(parse.kind)
+        self.indexes.append(parse.index)
+        self.starts.append(0)
+        self.counts.append(len(parse.children))
+        return len(self.kinds) - 1
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def root(self):
+        return self.child(0)
+
+    def child(self, value):
+        if (value < 0):
+            return self.leaves[-1 - value]
+        view = self.__views.get(value)
+        if (view is None):
+            view = self.__views[value] = FlatParse(self, value)
+        return view
+
+    def to_parse(self):
+        """Rebuild the tree as Parse objects."""
+        nodes = [None] * len(self.kinds)
+        for node in range(len(self.kinds) - 1, -1, -1):
+            start = self.starts[node]
+            children = []
+            for value in self.children[start:start + self.counts[node]]:
+                children.append(self.leaves[-1 - value] if value < 0 else nodes[value])
+            nodes[node] = Parse(Parse.KINDS[self.kinds[node]], self.indexes[node], *children)
+        return nodes[0]
+
+    def to_bytes(self):
+        # kinds are numbered per process, so their names are written with them
+        used = sorted(set(self.kinds))
+        names = tuple(Parse.KINDS[kind] for kind in used)
+        numbers = dict((kind, i) for (i, kind) in enumerate(used))
+        kinds = array('H', (numbers[kind] for kind in self.kinds))
+        arrays = (kinds, self.indexes, self.starts, self.counts, self.children)
+        return FlatTree.MAGIC + marshal.dumps((names, tuple(values.tobytes() for values in arrays), tuple(self.leaves)))
+
+    @staticmethod
+    def from_bytes(data):
+        if (data[:len(FlatTree.MAGIC)] != FlatTree.MAGIC):
+            raise ValueError('not a flat tree')
+        (names, arrays, leaves) = marshal.loads(data[len(FlatTree.MAGIC):])
+        tree = FlatTree()
+        for (values, raw) in zip((tree.kinds, tree.indexes, tree.starts, tree.counts, tree.children), arrays):
+            values.frombytes(raw)
+        numbers = [Parse.kind_of(name) for name in names]
+        tree.kinds = array('H', (numbers[kind] for kind in tree.kinds))
+        tree.leaves = list(leaves)
+        return tree
+
+    def nbytes(self):
+        arrays = (self.kinds, self.indexes, self.starts, self.counts, self.children)
+        return sum(values.itemsize * len(values) for values in arrays) + 8 * len(self.leaves)
+
+class FlatParse(Parse):
+    """A view of one node of a FlatTree that reads like a Parse."""
+
+    __slots__ = ('tree', 'node')
+
+    def __init__(self, tree, node):
+        self.tree = tree
+        self.node = node
+
+    @property
+    def kind(self):
+        return self.tree.kinds[self.node]
+
+    @property
+    def type(self):
+        return Parse.KINDS[self.tree.kinds[self.node]]
+
+    @property
+    def index(self):
+        return self.tree.indexes[self.node]
+
+    @property
+    def children(self):
+        tree = self.tree
+        start = tree.starts[self.node]
+        return tuple(tree.child(value) for value in tree.children[start:start + tree.counts[self.node]])
+
+def _size(parse):
+    import sys
+    total = 0
+    stack = [parse]
+    while (len(stack) > 0):
+        node = stack.pop()
+        if (isinstance(node, Parse)):
+            total += sys.getsizeof(node) + sys.getsizeof(node.children)
+            stack.extend(node.children)
+    return total
+
+def main():
+    import contextlib
+    import io
+    import time
+    from interpreter import Interpreter
+    from parser import Parser
+
+    block = 'var f%(i)d = func(n) { var s = 0; var k = 0; while (k < n) { s = s + k * 2 - k / 3; k = k + 1; } ret s; };\nvar x%(i)d = f%(i)d(%(i)d);\nif (x%(i)d > 10) { print x%(i)d; } else { print 0 - x%(i)d; }\n'
+    source = ''.join(block%{'i': i} for i in range(300))
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        parse = Parser().parse(source, 'program')
+        parsing = time.perf_counter() - start
+    tree = FlatTree(parse)
+    print('%d lines, %d nodes, parsed in %.3fs'%(source.count('\n'), len(tree), parsing))
+    print('Parse objects: %d bytes, flat arrays: %d bytes'%(_size(parse), tree.nbytes()))
+    assert str(tree.root()) == str(parse) and str(tree.to_parse()) == str(parse)
+    for (name, program) in (('Parse objects', parse), ('flat tree view', tree.root())):
+        start = time.perf_counter()
+        output = Interpreter().execute(program)
+        print('interpreting %s: %.3fs'%(name, time.perf_counter() - start))
+
+if __name__ == '__main__':
+    main()
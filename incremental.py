@@ -0,0 +1,205 @@
+from bisect import bisect_right
+
+from parse import Parse
+from parser import Parser
+
+class IncrementalParser(Parser):
+    """Parser that keeps its result and reparses only what an edit touches.
+
+    A program is its leading whitespace followed by program tails, each a
+    top-level statement and the whitespace after it. Rules only look
+    forward from where they start, so a tail parses the same however the
+    text before it changes, and after an edit every tail starting at or
+    after the end of the replaced text is still valid once its start is
+    shifted. A tail before the edit can only have looked past its end by
+    the 'else' an if statement checks for, so tails ending more than
+    LOOKAHEAD characters before the edit are kept as they are. The rest are
+    parsed again from the first one that may be affected until a new tail
+    ends where a shifted old one starts, and from there the old tails are
+    reused. Where a tail fails to parse the tree is None, but the tails
+    after the failure are kept, so fixing the error reparses only around it.
+    """
+
+    LOOKAHEAD = len(' else')
+
+    def __init__(self, share=None):
+        super().__init__(share=share)
+        self.source = ''
+        self.tree = None
+        # where each tail starts; those from __gap on are stored without
+        # __delta, so an edit shifts every tail after it by changing one number
+        self.__starts = []
+        self.__gap = 0
+        self.__delta = 0
+        self.__statements = [] # the normalized statement of each tail
+        # where a tail failed to parse; the tails after a failure are kept so
+        # the tree can be put back together once the error is fixed
+        self.__holes = []
+        self.reparsed = 0 # characters parsed again by the last edit
+
+    def parse(self, string, term='program'):
+        if (term != 'program'):
+            return super().parse(string, term)
+        self.source = string
+        self.__starts = []
+        self.__gap = 0
+        self.__delta = 0
+        self.__statements = []
+        self.__holes = []
+        self.__tails(0, 0, 0)
+        return self.__finish()
+
+    def edit(self, offset, deleted, inserted):
+        """Replace deleted characters at offset by inserted and return the new tree."""
+        old = self.source
+        if (offset < 0 or offset + deleted > len(old)):
+            raise ValueError('edit outside the program')
+        self.source = old[:offset] + inserted + old[offset + deleted:]
+        delta = len(inserted) - deleted
+        changed = offset + deleted # where the text after the edit starts, before shifting
+        first = max(self.__count(offset - IncrementalParser.LOOKAHEAD) - 1, 0)
+        # a tail that failed, and the tail before it, may have looked any
+        # distance ahead, so they are tried again after any later edit
+        holes = self.__holes
+        if (len(holes) > 0 and holes[0] < offset):
+            first = min(first, max(self.__count(holes[0] - 1) - 1, 0))
+        reuse = self.__count(changed - 1)
+        self.__move_gap(reuse)
+        self.__delta += delta
+        self.__holes = [hole + delta if hole >= changed else hole for hole in holes if hole < offset or hole >= changed]
+        position = self.__starts[first] if first > 0 else 0
+        self.__tails(position, first, reuse)
+        return self.__finish()
+
+    def __count(self, position):
+        # how many tails start at or before position
+        starts = self.__starts
+        gap = self.__gap
+        if (gap < len(starts) and starts[gap] + self.__delta <= position):
+            return bisect_right(starts, position - self.__delta, gap)
+        return bisect_right(starts, position, 0, gap)
+
+    def __move_gap(self, gap):
+        starts = self.__starts
+        delta = self.__delta
+        if (gap < self.__gap):
+            starts[gap:self.__gap] = [start - delta for start in starts[gap:self.__gap]]
+        else:
+            starts[self.__gap:gap] = [start + delta for start in starts[self.__gap:gap]]
+        self.__gap = gap
+
+    def __tails(self, position, first, reuse):
+        # replaces the tails from first up to reuse by parsing from position
+        # until a tail ends where one from reuse on starts
+        string = self.source
+        self._string = string
+        begin = position
+        if (position == 0):
+            position = self._parse(string, 'opt_space', 0).index
+        starts = self.__starts
+        delta = self.__delta
+        new_starts = []
+        new_statements = []
+        holes = [hole for hole in self.__holes if hole < begin]
+        k = reuse
+        while True:
+            while (k < len(starts) and starts[k] + delta < position):
+                k += 1
+            if (k < len(starts) and starts[k] + delta == position):
+                break
+            # every tail has its own memo; entries from one are almost never
+            # used by the next and would only pile up
+            self._cache = dict()
+            tail = self._parse(string, 'program_tail', position)
+            if (tail is Parser.FAIL):
+                # like Parser.parse, the last character may be left over
+                if (position < len(string) - 1):
+                    holes.append(position)
+                if (k == len(starts)):
+                    break
+                position = starts[k] + delta
+                continue
+            new_starts.append(position)
+            new_statements.extend(self._normalize(tail))
+            position = tail.index
+        self._cache = dict()
+        self.reparsed = position - begin
+        starts[first:k] = new_starts
+        self.__statements[first:k] = new_statements
+        self.__gap = first + len(new_starts)
+        # an old hole at position itself is one this parse did not record
+        self.__holes = holes + [hole for hole in self.__holes if hole > position]
+
+    def __finish(self):
+        if (len(self.__holes) > 0):
+            self.tree = None
+        elif (self._share is not None):
+            self.tree = self._share.node('sequence', 0, *self.__statements)
+        else:
+            self.tree = Parse('sequence', 0, *self.__statements)
+        return self.tree
+
+def main():
+    import contextlib
+    import io
+    import random
+    import time
+
+    lines = ['var acc = 0;', 'var f = func(a, b) {', '  ret a * 2 + b;', '};']
+    while (len(lines) < 10000):
+        i = len(lines)
+        lines.append('var v%d = (acc + %d) * 3 - f(%d, acc) / 2;'%(i, i, i))
+        lines.append('if (v%d > 10) { acc = acc + 1; } else { acc = acc - 1; }'%i)
+        lines.append('print acc; # note %d'%i)
+    source = '\n'.join(lines) + '\n'
+    # single-line edits, some of which leave a syntax error for the next one to fix
+    random.seed(337)
+    text = source
+    edits = []
+    while (len(edits) < 200):
+        line = text.rfind('\n', 0, random.randrange(len(text) - 1)) + 1
+        end = text.index('\n', line)
+        digit = text.find('1', line, end)
+        choice = len(edits) % 4
+        if (choice == 0 and digit >= 0):
+            new = [(digit, 1, '7')]
+        elif (choice == 1):
+            new = [(line, 0, 'print %d;\n'%len(edits))]
+        elif (choice == 2):
+            new = [(end - 1, 0, '('), (end - 1, 1, '')]
+        else:
+            new = [(line, 0, '  ')]
+        for (offset, deleted, inserted) in new:
+            text = text[:offset] + inserted + text[offset + deleted:]
+        edits.extend(new)
+    parser = IncrementalParser()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        parser.parse(source)
+        full = time.perf_counter() - start
+        times = []
+        for (offset, deleted, inserted) in edits:
+            start = time.perf_counter()
+            parser.edit(offset, deleted, inserted)
+            times.append(time.perf_counter() - start)
+        expected = IncrementalParser().parse(parser.source)
+    assert parser.source == text
+    assert parser.tree == expected
+    print('full parse of %d lines: %.2fs'%(len(lines), full))
+    times.sort()
+    print('%d single-line edits: median %.3fms, 90th percentile %.3fms, max %.3fms'%(len(times), times[len(times) // 2] * 1e3, times[len(times) * 9 // 10] * 1e3, times[-1] * 1e3))
+    # random edits of small programs, each result checked against a full parse
+    pieces = ['var x = 1;', 'print x;', 'if (x) { print 1; }', ' else { print 2; }', 'e', ' ', '\n', '#c\n', '(', '}', ';', 'x = 2;']
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(1000):
+            parser = IncrementalParser()
+            parser.parse(''.join(random.choice(pieces) for j in range(random.randrange(1, 6))))
+            for j in range(5):
+                offset = random.randrange(len(parser.source) + 1)
+                deleted = random.randrange(min(3, len(parser.source) - offset) + 1)
+                tree = parser.edit(offset, deleted, random.choice(['', random.choice(pieces), random.choice('e;{}( x')]))
+                assert str(tree) == str(Parser().parse(parser.source, 'program')), repr(parser.source)
+    print('1000 random edit sequences match full parses')
+
+if __name__ == '__main__':
+    main()
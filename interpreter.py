@@ -1,59 +1,119 @@
-from environment import Environment
+from environment import ArrayEnvironment, Environment
 from errors import *
+from limits import Limits
+from output import Output
 from parse import Parse
 from pointer import Pointer
+from resolver import Resolver, creates_closures, declarations
 from closure import Closure
+from codegen import CodeGenerator
+from compiler import Code, Compiler
 from sexp import sexp
+from tracing import ListSink
 from parser import Parser
+from vm import VM
 
 class Interpreter:
-    def __init__(self, debug=False):
-        self.__out = ''
-        self.__environment = Environment()
+    def __init__(self, debug=False, vm=False, trace=None, output=None, resolve=False, native=False, profile=None, max_steps=None, timeout=None, max_depth=None, limits=None):
+        # vm runs programs by compiling them to bytecode for VM instead of
+        # walking the tree; output and errors are the same either way
+        self.__vm = vm
+        # resolve runs Resolver over programs first so variables are read by
+        # slot from ArrayEnvironments instead of searched for by name
+        self.__resolve = resolve
+        # native translates programs to Python source with CodeGenerator and
+        # runs the compiled code
+        self.__native = native
+        self.__environment_class = ArrayEnvironment if (resolve or native) else Environment
+        # output is an Output or a target for one (a path, a stream or a
+        # callback); by default printed lines are kept and returned by execute.
+        # An Output made here is closed after every execute
+        self.__owns_output = not isinstance(output, Output)
+        if (self.__owns_output):
+            output = Output(output)
+        self.__output = output
+        self.__environment = self.__environment_class()
         self.__tab = 0
         self.__debug = debug
-        self.__debug_out = ''
+        # trace is a sink from tracing that receives an event per node; with
+        # no sink the evaluator does no tracing work at all
+        if (debug and trace is None):
+            trace = ListSink()
+        self.__trace = trace
+        # profile is a profiler.Profiler told about every node and call the
+        # tree-walking modes run; the bytecode and native modes ignore it
+        self.__profile = profile
+        # max_steps and timeout (in seconds) stop a program that runs too long
+        # with a StepLimitError or TimeLimitError, and max_depth one that
+        # opens too many calls at once with a CallDepthError; with none of
+        # them, loops and calls skip the counting. limits is a Limits (or a
+        # subclass) to use instead of one made from them
+        self.__limits = limits
+        if (limits is None and (max_steps is not None or timeout is not None or max_depth is not None)):
+            self.__limits = Limits(max_steps, timeout, max_depth)
+        self.__error = None
         self.__return = 0
         self.__function_depth = 0
         self.__is_returning = False
+        # blocks that declare nothing run in the enclosing environment; this
+        # counts how many of them are open since the last real environment
+        self.__elided = 0
+        self.__blocks = {}
 
-    def _debug(self, output):
-        self.__debug_out += ("  "*self.__tab) + str(output) + '\n'
+    def _debug(self, kind, *fields):
+        if (self.__trace is not None):
+            self.__trace.write((self.__tab, kind) + fields)
 
     def _out(self, output):
-        self.__out += str(output) + '\n'
+        self.__output.write(str(output))
 
     def _eval(self, parse):
-        self._debug("eval %s with environment=%s"%(parse, self.__environment))
+        trace = self.__trace
+        if (trace is not None):
+            trace.write((self.__tab, 'eval', parse, str(self.__environment)))
         if (self.__is_primitive(parse)):
-            self.__tab += 1
-            self._debug('got the %s %s'%(self.__type(parse),parse))
-            self.__tab -= 1
+            if (trace is not None):
+                trace.write((self.__tab + 1, 'got', self.__type(parse), parse))
             return parse
         self.__tab += 1
 
         renamed_types = { '+':'add', '-': 'sub', '*': 'mul', '/': 'div', '||': 'or', '&&': 'and', '!':'not', '<':'lt', '>': 'gt', '<=': 'leq', '>=': 'geq', '==': 'eq', '!=': 'neq'}
-        evaluator = getattr(self, '_eval_%s'%(renamed_types.get(parse.type, parse.type)), None)
+        # the type property costs a call; the kind is a plain slot
+        name = Parse.KINDS[parse.kind]
+        evaluator = getattr(self, '_eval_%s'%(renamed_types.get(name, name)), None)
         if (not callable(evaluator)):
             raise RuntimeError()
 
-        result = evaluator(parse)
-        self._debug('got the %s %s'%(self.__type(result),result))
+        profile = self.__profile
+        if (profile is not None):
+            profile.enter(parse)
+            result = evaluator(parse)
+            profile.leave()
+        else:
+            result = evaluator(parse)
+        if (trace is not None):
+            trace.write((self.__tab, 'got', self.__type(result), str(result)))
         self.__tab -= 1
         return result
 
     def _exec(self, parse):
-        self._debug("exec %s with environment=%s"%(parse, self.__environment))
-        self._debug("type: %s"%(type(parse)))
+        if (self.__trace is not None):
+            self.__trace.write((self.__tab, 'exec', parse, str(self.__environment)))
+            self.__trace.write((self.__tab, 'type', type(parse)))
         if (self.__is_primitive(parse)):
             return parse
 
         renamed_types = { '+':'add', '-': 'sub', '*': 'mul', '/': 'div'}
-        executor = getattr(self, '_exec_%s'%(renamed_types.get(parse.type, parse.type)), None)
+        name = Parse.KINDS[parse.kind]
+        executor = getattr(self, '_exec_%s'%(renamed_types.get(name, name)), None)
         self.__tab += 1
         result = None
         if (not callable(executor)):
             result = self._eval(parse)
+        elif (self.__profile is not None):
+            self.__profile.enter(parse)
+            result = executor(parse)
+            self.__profile.leave()
         else:
             result = executor(parse)
         #self._debug('got %s'%result)
@@ -80,20 +140,71 @@ class Interpreter:
 
     def execute(self, parse):
         self.__tab = 0;
-        self._debug("Interpreting %s"%parse)
+        self.__elided = 0
+        self.__blocks = {}
+        self.__error = None
+        environment = self.__environment
+        self._debug('interpreting', parse)
+        if (self.__limits is not None):
+            self.__limits.start()
         try:
-            self._exec(parse)
-        except RuntimeError as e:
+            if (self.__vm):
+                # a program compiled once with Compiler can be run again as it is
+                code = parse if isinstance(parse, Code) else Compiler().compile(parse)
+                VM(self._out, self.__limits).run(code, environment)
+            elif (self.__native):
+                program = CodeGenerator(self.__environment, self.__limits).compile(parse)
+                if (program is not None):
+                    program(self._out)
+                else:
+                    # too deeply nested for Python; the environments are the
+                    # same as in resolve mode, so it runs there instead
+                    self.__run(Resolver(self.__environment).resolve(parse))
+            elif (self.__resolve):
+                self.__run(Resolver(self.__environment).resolve(parse))
+            else:
+                self.__run(parse)
+        except (RuntimeError, RecursionError) as e:
+            if (isinstance(e, RecursionError)):
+                # the program's calls went deeper than Python's stack allows
+                e = CallDepthError(self.__function_depth)
+            self.__error = e
             self._out(e)
         finally:
-            if (len(self.__out) > 0):
-                self.__out = self.__out[:-1]
-            if (len(self.__debug_out) > 0):
-                self.__debug_out = self.__debug_out[:-1]
+            # an error may have stopped a call midway; the next execute
+            # starts at the top level again
+            self.__environment = environment
+            self.__function_depth = 0
+            self.__is_returning = False
+            self.__return = 0
+            if (self.__profile is not None):
+                self.__profile.finish()
+            out = self.__output.text()
+            if (self.__owns_output):
+                self.__output.close()
             if (self.__debug):
-                return (self.__out, self.__debug_out)
+                return (out, self.__trace.text())
             else:
-                return self.__out
+                return out
+
+    def steps(self):
+        """Return how many steps the last execute took, or None without limits."""
+        if (self.__limits is None):
+            return None
+        return self.__limits.steps
+
+    def environment(self):
+        """Return the global environment, which every execute shares."""
+        return self.__environment
+
+    def error(self):
+        """Return the runtime error that stopped the last execute, or None."""
+        return self.__error
+
+    def __run(self, parse):
+        if (self.__profile is not None):
+            self.__profile.start(parse)
+        self._exec(parse)
 
     def _eval_add(self, parse):
         (operandA, operandB) = parse.children
@@ -133,12 +244,49 @@ class Interpreter:
     def _eval_lookup(self, parse):
         var = parse.children[0]
         environment = self.__environment
-        while((not environment.contains(var)) and (not self.__is_returning)):
+        # after a ret, _exec_while tests its condition once more with the
+        # lookups searching only the environment of the block the loop is
+        # in (empty if that block was elided); every engine reports a
+        # variable missing there as undefined
+        if (self.__is_returning and (self.__elided > 0 or not environment.contains(var))):
+            raise UndefinedVariableError()
+        while(not environment.contains(var)):
             environment = environment.get_parent()
             if (environment == None):
                 raise UndefinedVariableError()
         return environment.get(var)
 
+    def _eval_slot_lookup(self, parse):
+        (var, addresses) = parse.children
+        if (self.__is_returning):
+            # like _eval_lookup, only the innermost environment is searched
+            if (self.__elided > 0 or len(addresses) == 0 or addresses[0][0] != 0 or addresses[0][1] >= self.__environment.size()):
+                raise UndefinedVariableError()
+            return self.__environment.get_slot(addresses[0][1])
+        for (depth, slot) in addresses:
+            environment = self.__environment
+            while (depth > 0):
+                environment = environment.get_parent()
+                depth -= 1
+            if (slot < environment.size()):
+                return environment.get_slot(slot)
+        raise UndefinedVariableError()
+
+    def _eval_slot_varloc(self, parse):
+        (var, addresses) = parse.children
+        (environment, slot) = self.__slot(addresses)
+        return Pointer(environment, var)
+
+    def __slot(self, addresses):
+        for (depth, slot) in addresses:
+            environment = self.__environment
+            while (depth > 0):
+                environment = environment.get_parent()
+                depth -= 1
+            if (slot < environment.size()):
+                return (environment, slot)
+        raise UndefinedVariableError()
+
     def _eval_varloc(self, parse):
         var = parse.children[0]
         environment = self.__environment
@@ -262,7 +410,7 @@ class Interpreter:
         if (len(closure.params()) != len(args.children)):
             raise ArgumentMismatchError()
 
-        func_environment = Environment(closure.environment())
+        func_environment = self.__environment_class(closure.environment())
         for param, arg, type in zip(closure.params(), args.children, closure.signature()[:-1]):
             val = self._eval(arg)
             if (type not in ('var', self.__type(val))):
@@ -275,8 +423,18 @@ class Interpreter:
         self.__function_depth += 1
         returning = self.__is_returning
         self.__is_returning = False
-
-        self._exec(closure.body())
+        elided = self.__elided
+        self.__elided = 0
+
+        if (self.__limits is not None):
+            self.__limits.step()
+            self.__limits.enter(self.__function_depth)
+        if (self.__profile is not None):
+            self.__profile.call(closure)
+            self._exec(closure.body())
+            self.__profile.ret()
+        else:
+            self._exec(closure.body())
 
         value = self.__return
         if (closure.signature()[-1] not in ('var', self.__type(value))):
@@ -285,6 +443,7 @@ class Interpreter:
         self.__function_depth -= 1
         self.__return = 0
         self.__is_returning = returning
+        self.__elided = elided
 
         self.__environment = original_environment
 
@@ -314,39 +473,84 @@ class Interpreter:
             raise TypeMismatchError()
         self.__environment.set(var, val, type)
 
+    def _exec_slot_declare(self, parse):
+        (type, var, slot, value) = parse.children
+        val = self._eval(value)
+        if (slot < self.__environment.size()):
+            raise VariableAlreadyDefinedError()
+        if (type not in ('var', self.__type(val))):
+            raise TypeMismatchError()
+        self.__environment.declare(var, val, type)
+
     def _exec_assign(self, parse):
         val = self._eval(parse.children[1])
+        location = parse.children[0]
+        if (isinstance(location, Parse) and location.type == 'slot_varloc'):
+            # write the slot directly instead of going through a Pointer
+            (environment, slot) = self.__slot(location.children[1])
+            type = environment.get_slot_type(slot)
+            if (type not in ('var', self.__type(val))):
+                raise TypeMismatchError()
+            environment.set_slot(slot, val, type)
+            return
         ptr = self._eval(parse.children[0])
         type = ptr.type()
         if (type not in ('var', self.__type(val))):
             raise TypeMismatchError()
         ptr.set(val)
 
+    def __block(self, body):
+        # (declares anything, can capture its environment) for a block body;
+        # the body is kept in the entry so its id cannot be reused meanwhile
+        key = id(body)
+        if (key not in self.__blocks):
+            self.__blocks[key] = (len(declarations(body)) > 0, creates_closures(body), body)
+        return self.__blocks[key][:2]
+
+    def __exec_block(self, body, environment=None):
+        if (not self.__block(body)[0]):
+            self.__elided += 1
+            self._exec(body)
+            self.__elided -= 1
+            return
+        if (environment is None):
+            environment = self.__environment_class(self.__environment)
+        elided = self.__elided
+        self.__elided = 0
+        self.__environment = environment
+        self._exec(body)
+        self.__environment = environment.get_parent()
+        self.__elided = elided
+
     def _exec_while(self, parse):
         (cond, body) = parse.children
+        (declares, closures) = self.__block(body)
+        # without closures nothing can hold on to an iteration's environment,
+        # so one is emptied and reused instead of making a new one each time
+        environment = None
+        limits = self.__limits
         while((self._eval(cond) != 0) and (not self.__is_returning)):
-            self.__environment = Environment(self.__environment)
-            self._exec(body)
-            self.__environment = self.__environment.get_parent()
+            if (limits is not None):
+                limits.step()
+            if (declares and not closures):
+                if (environment is None):
+                    environment = self.__environment_class(self.__environment)
+                else:
+                    environment.clear()
+            self.__exec_block(body, environment)
 
     def _exec_if(self, parse):
         (cond, body) = parse.children
         if(self._eval(cond) != 0):
-            self.__environment = Environment(self.__environment)
-            self._exec(body)
-            self.__environment = self.__environment.get_parent()
+            self.__exec_block(body)
 
     def _exec_ifelse(self, parse):
         (cond, body_if, body_else) = parse.children
 
         if(self._eval(cond) != 0):
-            self.__environment = Environment(self.__environment)
-            self._exec(body_if)
-            self.__environment = self.__environment.get_parent()
+            self.__exec_block(body_if)
         else:
-            self.__environment = Environment(self.__environment)
-            self._exec(body_else)
-            self.__environment = self.__environment.get_parent()
+            self.__exec_block(body_else)
 
     def _exec_return(self, parse):
         if (self.__function_depth <= 0):
@@ -0,0 +1,296 @@
+import mmap
+
+from parse import Parse
+
+# A file is MAGIC, the kind table, the string table and then the root node.
+# Both tables are a count followed by that many length-prefixed UTF-8
+# strings. A node is its kind number, index, child count and the size in
+# bytes of its children, followed by the children, each a tag and a value;
+# the size lets a reader step over a subtree without decoding it. All
+# numbers are varints, zigzag encoded where they can be negative.
+MAGIC = b'LIR1'
+
+NODE = 0
+INT = 1
+STRING = 2
+TUPLE = 3
+
+def _varint(out, value):
+    while (value >= 0x80):
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _varint_size(value):
+    size = 1
+    while (value >= 0x80):
+        value >>= 7
+        size += 1
+    return size
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+def _unzigzag(value):
+    return value >> 1 if value & 1 == 0 else -(value >> 1) - 1
+
+def _read_varint(data, offset):
+    byte = data[offset]
+    if (byte < 0x80):
+        return (byte, offset + 1)
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7f) << shift
+        if (byte < 0x80):
+            return (value, offset)
+        shift += 7
+
+class Writer:
+    """Encodes a Parse tree, without recursion, into the binary format."""
+
+    def __init__(self):
+        self.__kinds = dict() # kind name -> number in the file
+        self.__strings = dict()
+
+    def __number(self, table, string):
+        if (string not in table):
+            table[string] = len(table)
+        return table[string]
+
+    def __leaf_size(self, leaf):
+        if (isinstance(leaf, bool) or not isinstance(leaf, (int, str, tuple))):
+            raise TypeError('cannot encode %r in a parse'%(leaf,))
+        if (isinstance(leaf, int)):
+            return 1 + _varint_size(_zigzag(leaf))
+        if (isinstance(leaf, str)):
+            return 1 + _varint_size(self.__number(self.__strings, leaf))
+        return 1 + _varint_size(len(leaf)) + sum(self.__leaf_size(item) for item in leaf)
+
+    def __leaf(self, out, leaf):
+        if (isinstance(leaf, int)):
+            out.append(INT)
+            _varint(out, _zigzag(leaf))
+        elif (isinstance(leaf, str)):
+            out.append(STRING)
+            _varint(out, self.__strings[leaf])
+        else:
+            out.append(TUPLE)
+            _varint(out, len(leaf))
+            for item in leaf:
+                self.__leaf(out, item)
+
+    def dumps(self, parse):
+        # first the size of every node's children, children before parents
+        sizes = dict()
+        stack = [(parse, False)]
+        while (len(stack) > 0):
+            (node, expanded) = stack.pop()
+            if (not expanded):
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children if isinstance(child, Parse))
+                continue
+            self.__number(self.__kinds, node.type)
+            size = 0
+            for child in node.children:
+                if (isinstance(child, Parse)):
+                    child_size = sizes[id(child)]
+                    size += 1 + self.__header_size(child, child_size) + child_size
+                else:
+                    size += self.__leaf_size(child)
+            sizes[id(node)] = size
+        # then the nodes in order
+        body = bytearray()
+        stack = [parse]
+        while (len(stack) > 0):
+            node = stack.pop()
+            if (not isinstance(node, Parse)):
+                self.__leaf(body, node)
+                continue
+            if (node is not parse):
+                body.append(NODE)
+            _varint(body, self.__kinds[node.type])
+            _varint(body, _zigzag(node.index))
+            _varint(body, len(node.children))
+            _varint(body, sizes[id(node)])
+            stack.extend(reversed(node.children))
+        out = bytearray(MAGIC)
+        for table in (self.__kinds, self.__strings):
+            _varint(out, len(table))
+            for string in table:
+                encoded = string.encode()
+                _varint(out, len(encoded))
+                out += encoded
+        return bytes(out + body)
+
+    def __header_size(self, node, size):
+        return _varint_size(self.__kinds[node.type]) + _varint_size(_zigzag(node.index)) + _varint_size(len(node.children)) + _varint_size(size)
+
+def dumps(parse):
+    return Writer().dumps(parse)
+
+def dump(parse, path):
+    with open(path, 'wb') as file:
+        file.write(dumps(parse))
+
+class Reader:
+    """Decodes the binary format straight from a buffer, one node at a time.
+
+    Nothing is decoded up front except the offsets of the strings; nodes
+    are read as they are reached, so a program can start running before
+    its later functions are ever looked at.
+    """
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        if (bytes(self.data[:len(MAGIC)]) != MAGIC):
+            raise ValueError('not a binary parse')
+        offset = len(MAGIC)
+        (kinds, offset) = self.__table(offset)
+        self.kinds = [Parse.kind_of(self.__string(start, end)) for (start, end) in kinds]
+        (self.__string_spans, offset) = self.__table(offset)
+        self.__strings = [None] * len(self.__string_spans)
+        self.root_offset = offset
+
+    def __table(self, offset):
+        (count, offset) = _read_varint(self.data, offset)
+        spans = []
+        for i in range(count):
+            (length, offset) = _read_varint(self.data, offset)
+            spans.append((offset, offset + length))
+            offset += length
+        return (spans, offset)
+
+    def __string(self, start, end):
+        return str(self.data[start:end], 'utf-8')
+
+    def string(self, number):
+        string = self.__strings[number]
+        if (string is None):
+            string = self.__strings[number] = self.__string(*self.__string_spans[number])
+        return string
+
+    def header(self, offset):
+        """Return (kind, index, child count, children offset, end offset) of a node."""
+        data = self.data
+        (kind, offset) = _read_varint(data, offset)
+        (index, offset) = _read_varint(data, offset)
+        (count, offset) = _read_varint(data, offset)
+        (size, offset) = _read_varint(data, offset)
+        return (self.kinds[kind], _unzigzag(index), count, offset, offset + size)
+
+    def value(self, offset):
+        """Return (child, offset after it) for the child encoded at offset."""
+        data = self.data
+        tag = data[offset]
+        offset += 1
+        if (tag == NODE):
+            node = LazyParse(self, offset)
+            return (node, node.end)
+        (number, offset) = _read_varint(data, offset)
+        if (tag == INT):
+            return (_unzigzag(number), offset)
+        if (tag == STRING):
+            return (self.string(number), offset)
+        items = []
+        for i in range(number):
+            (item, offset) = self.value(offset)
+            items.append(item)
+        return (tuple(items), offset)
+
+    def root(self):
+        return LazyParse(self, self.root_offset)
+
+    def to_parse(self):
+        """Decode the whole tree into Parse objects."""
+        (kind, index, count, offset, end) = self.header(self.root_offset)
+        root = [Parse.KINDS[kind], index, count, offset, []]
+        stack = [root]
+        while True:
+            frame = stack[-1]
+            if (len(frame[4]) == frame[2]):
+                stack.pop()
+                node = Parse(frame[0], frame[1], *frame[4])
+                if (len(stack) == 0):
+                    return node
+                stack[-1][4].append(node)
+                continue
+            offset = frame[3]
+            if (self.data[offset] == NODE):
+                (kind, index, count, children, end) = self.header(offset + 1)
+                frame[3] = end
+                stack.append([Parse.KINDS[kind], index, count, children, []])
+            else:
+                (value, frame[3]) = self.value(offset)
+                frame[4].append(value)
+
+class LazyParse(Parse):
+    """A node of a Reader that decodes its children the first time they are used."""
+
+    __slots__ = ('reader', 'start', 'end', 'count', 'decoded')
+
+    def __init__(self, reader, offset):
+        (kind, index, count, start, end) = reader.header(offset)
+        self.kind = kind
+        self.index = index
+        self.reader = reader
+        self.start = start
+        self.end = end
+        self.count = count
+        self.decoded = None
+
+    @property
+    def children(self):
+        if (self.decoded is None):
+            children = []
+            offset = self.start
+            for i in range(self.count):
+                (child, offset) = self.reader.value(offset)
+                children.append(child)
+            self.decoded = tuple(children)
+        return self.decoded
+
+def open_file(path):
+    """Map a binary parse file into memory and return a Reader for it."""
+    with open(path, 'rb') as file:
+        return Reader(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+def main():
+    import contextlib
+    import io
+    import os
+    import tempfile
+    import time
+    from flattree import FlatTree
+    from interpreter import Interpreter
+    from parser import Parser
+    from sexp import sexp
+
+    block = 'var f%(i)d = func(n) { var s = 0; var k = 0; while (k < n) { s = s + k * 2 - k / 3; k = k + 1; } ret s; };\nvar x%(i)d = f%(i)d(%(i)d);\nif (x%(i)d > 10) { print x%(i)d; } else { print 0 - x%(i)d; }\n'
+    source = ''.join(block%{'i': i} for i in range(300))
+    with contextlib.redirect_stdout(io.StringIO()):
+        parse = Parser().parse(source, 'program')
+    text = str(parse)
+    data = dumps(parse)
+    print('s-expression: %d bytes, flat tree: %d bytes, binary: %d bytes'%(len(text), len(FlatTree(parse).to_bytes()), len(data)))
+    path = os.path.join(tempfile.mkdtemp(), 'program.lir')
+    dump(parse, path)
+    start = time.perf_counter()
+    sexp(text)
+    print('reading the s-expression: %.4fs'%(time.perf_counter() - start))
+    start = time.perf_counter()
+    decoded = open_file(path).to_parse()
+    print('decoding the whole file: %.4fs'%(time.perf_counter() - start))
+    assert decoded == parse
+    start = time.perf_counter()
+    reader = open_file(path)
+    last = reader.root().children[-1]
+    print('decoding only the last statement: %.6fs %s'%(time.perf_counter() - start, last))
+    output = Interpreter().execute(open_file(path).root())
+    assert output == Interpreter().execute(parse)
+    print(output.splitlines()[-1])
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import re
+
+class Lexer:
+    IDENTIFIER = 'identifier'
+    KEYWORD = 'keyword'
+    INTEGER = 'integer'
+    OPERATOR = 'operator'
+    ERROR = 'error'
+
+    # whitespace and comments are matched as one run so they never become tokens;
+    # longer operators come first so '<=' is not read as '<' followed by '='
+    TOKEN = re.compile(r'''
+        (?P<space>(?:[ \n\t]|\#[^\n]*\n)+)
+        |(?P<identifier>[^\W\d]\w*)
+        |(?P<integer>\d+)
+        |(?P<operator>==|!=|<=|>=|&&|\|\||->|[-+*/<>!=(){},;])
+    ''', re.VERBOSE)
+
+    def __init__(self, keywords=()):
+        self.__keywords = frozenset(keywords)
+
+    def tokenize(self, string):
+        """Split a program into (kind, value, offset) tuples in a single pass.
+
+        Integer values are converted to ints. Scanning stops at the first
+        character that cannot start a token, which is reported as an error
+        token so the parser can still tell how far the program was valid.
+        """
+        tokens = []
+        match = Lexer.TOKEN.match
+        keywords = self.__keywords
+        index = 0
+        length = len(string)
+        while (index < length):
+            token = match(string, index)
+            if (token is None):
+                tokens.append((Lexer.ERROR, string[index], index))
+                break
+            kind = token.lastgroup
+            if (kind != 'space'):
+                value = token.group()
+                if (kind == Lexer.IDENTIFIER):
+                    if (value in keywords):
+                        kind = Lexer.KEYWORD
+                elif (kind == Lexer.INTEGER):
+                    value = int(value)
+                tokens.append((kind, value, index))
+            index = token.end()
+        return tokens
+
+def main():
+    lexer = Lexer(['print', 'var', 'func', 'ret'])
+    for token in lexer.tokenize('var f = func(a) { ret a * 12; }; # comment\nprint f(3);\n'):
+        print(token)
+
+if __name__ == '__main__':
+    main()
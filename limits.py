@@ -0,0 +1,61 @@
+import time
+
+from errors import CallDepthError, StepLimitError, TimeLimitError
+
+class Limits:
+    """A step budget and a wall-clock timeout for running a program.
+
+    A step is one loop iteration or one function call. Everything a program
+    does between two steps is bounded by the size of its source, so
+    counting only those is enough to stop any program, and the engines pay
+    nothing per node. The clock is read every CLOCK_INTERVAL steps.
+    max_depth bounds how many calls can be open at once in the tree-walking
+    modes and the VM; native code is bounded by Python's recursion limit.
+    """
+
+    CLOCK_INTERVAL = 256
+
+    def __init__(self, max_steps=None, timeout=None, max_depth=None):
+        self.max_steps = max_steps
+        self.timeout = timeout # seconds
+        self.max_depth = max_depth
+        self.steps = 0
+        self.__deadline = None
+
+    def start(self):
+        self.steps = 0
+        self.__deadline = None
+        if (self.timeout is not None):
+            self.__deadline = time.monotonic() + self.timeout
+
+    def extend(self, seconds):
+        """Move the deadline back, for time the program spent not running."""
+        if (self.__deadline is not None):
+            self.__deadline += seconds
+
+    def step(self):
+        if (self.max_steps is not None and self.steps >= self.max_steps):
+            raise StepLimitError(self.steps)
+        self.steps += 1
+        if (self.__deadline is not None and self.steps % Limits.CLOCK_INTERVAL == 0 and time.monotonic() > self.__deadline):
+            raise TimeLimitError(self.steps)
+
+    def enter(self, depth):
+        """Check a call that makes depth calls open, after its step."""
+        if (self.max_depth is not None and depth > self.max_depth):
+            raise CallDepthError(depth)
+
+def main():
+    from interpreter import Interpreter
+    from parser import Parser
+
+    program = Parser().parse('var i = 0;\nwhile (1) {\n  i = i + 1;\n}\n', 'program')
+    for options in ({'max_steps': 10000}, {'timeout': 0.5}, {'vm': True, 'timeout': 0.5}, {'native': True, 'timeout': 0.5}):
+        interpreter = Interpreter(**options)
+        print('%s: %s (%d steps)'%(options, interpreter.execute(program), interpreter.steps()))
+    program = Parser().parse('var f = func(n) {\n  ret f(n + 1);\n};\nprint f(0);\n', 'program')
+    for options in ({'max_depth': 100}, {'vm': True, 'max_depth': 100}, {}, {'native': True}):
+        print('%s: %s'%(options, Interpreter(**options).execute(program)))
+
+if __name__ == '__main__':
+    main()
@@ -1,64 +1,56 @@
-import re
+import contextlib
+import io
 import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
-from parser import Parser # FIXME change this line to use your code if necessary
+from parser import Parser, TokenParser # FIXME change this line to use your code if necessary
 from interpreter import Interpreter # FIXME change this line to use your code if necessary
-from sexp import sexp as sexp_to_parse, validate_parse
+from sexp import sexp as sexp_to_parse, normalize_sexp, validate_parse
 from transforms import ConstantFoldingTransform
+from cache import CompileCache
 
-def normalize_sexp(string):
-
-    def fail(index):
-        return None, index
-
-    def skip_whitespace(string, index):
-        while index < len(string) and string[index] in ' \n':
-            index += 1
-        return index
-
-    def _normalize_sexp(string, index):
-        if index > len(string):
-            return fail(index)
-        index = skip_whitespace(string, index)
-        sexp = ''
-        if index < len(string) and string[index] == '(':
-            index = skip_whitespace(string, index + 1)
-            sexp += '('
-        match = re.match('[^() \n]+', string[index:])
-        if not match:
-            return fail(index)
-        if sexp == '':
-            return match.group(), index + len(match.group())
-        sexp = '(' + match.group()
-        index += len(match.group())
-        # match all children
-        while True:
-            index = skip_whitespace(string, index)
-            # match a child
-            child, index = _normalize_sexp(string, index)
-            if child is None:
-                break
-            sexp += ' ' + child
-        index = skip_whitespace(string, index)
-        if not string[index] == ')':
-            raise SyntaxError('malformed S-expression')
-        sexp += ')'
-        index = skip_whitespace(string, index + 1)
-        return sexp, index
-
-    sexp, index = _normalize_sexp(string, 0)
-    if index == len(string):
-        return sexp
-    else:
-        raise SyntaxError('malformed S-expression')
-
+# the VM runs programs without recursing, but parsing, normalizing, the
+# transforms and the bytecode compiler take Python frames for every level of
+# nesting in the source: at most about 11 per character, for nested
+# parentheses
+FRAMES_PER_CHARACTER = 12
 
+def raise_recursion_limit(text):
+    """Raise the recursion limit to what parsing and compiling text can need."""
+    limit = 1000 + FRAMES_PER_CHARACTER * len(text)
+    if (limit > sys.getrecursionlimit()):
+        sys.setrecursionlimit(limit)
 
 def fix_newlines(string):
     return '\n'.join(line for line in string.splitlines() if line.strip()) + '\n'
 
 
+def parse_program(program, cache=None, tokens=False):
+    """Parse a program, reusing the compile cache's copy if there is one.
+
+    Parameters:
+        program (str): The source of the program.
+        cache (CompileCache): The cache to use, or None to always parse.
+        tokens (Boolean): Parse the lexer's tokens with TokenParser
+
+    Returns:
+        Parse: The program's parse, or None for a syntax error.
+    """
+    parser = TokenParser(check=True) if tokens else Parser(check=True)
+    if (cache is None):
+        return parser.parse(program, 'program')
+    return cache.parse(program, lambda: parser.parse(program, 'program'))
+
+def transform_program(program, parse, cache=None):
+    """Apply the code transforms to a program's parse, reusing a cached result."""
+    transformer = ConstantFoldingTransform()
+    if (cache is None):
+        return transformer.visit(parse)
+    return cache.parse(program, lambda: parse, [('ConstantFoldingTransform', transformer.visit)])
+
 def test_sexp(sexp_path, parse, message):
     """Test a parse's S-expression, if one is specified.
 
@@ -98,7 +90,7 @@ def test_transform(sexp2_path, parse, message):
     assert actual_sexp2 == expected_sexp2, '\n' + '\n'.join(error)
 
 
-def test_with_file(lang_path, interpreter_only, parser_only, transform):
+def test_with_file(lang_path, interpreter_only, parser_only, transform, cache=None, tokens=False):
     """Test using the lang program at the file path.
 
     Parameters:
@@ -106,6 +98,8 @@ def test_with_file(lang_path, interpreter_only, parser_only, transform):
         interpreter_only (Boolean): Test only the interpreter
         parser_only (Boolean): Test only the parser
         transform (Boolean): Include code transforms
+        cache (CompileCache): Where to keep parses between runs, if anywhere
+        tokens (Boolean): Parse with TokenParser
 
     Raises:
         AssertError: If the test does not pass.
@@ -113,13 +107,13 @@ def test_with_file(lang_path, interpreter_only, parser_only, transform):
     # read the program to run
     with lang_path.open() as fd:
         program = fix_newlines(fd.read())
+    raise_recursion_limit(program)
     print()
     print(f'RUNNING {lang_path}')
     print(program)
     # parse the code
     if (not (interpreter_only or parser_only)):
-        parser = Parser()
-        parse = parser.parse(program, 'program')
+        parse = parse_program(program, cache, tokens)
         print("parse: %s"%parse)
         assert validate_parse(parse), 'Invalid sexp parse: %s'%parse
         if parse is None:
@@ -131,13 +125,12 @@ def test_with_file(lang_path, interpreter_only, parser_only, transform):
             test_sexp(sexp_path, parse, 'intermediate representation does not match')
             if (transform):
                 sexp2_path = lang_path.parent.joinpath(lang_path.stem + '.sexp2')
-                transformer = ConstantFoldingTransform()
-                parse = transformer.visit(parse)
+                parse = transform_program(program, parse, cache)
                 test_transform(sexp2_path, parse, 'transformed intermediate representation does not match')
-            # run the program to get the output
-            results = Interpreter(True).execute(parse)
-            #print(results[1])
-            actual_output = results[0]
+            # run the program to get the output; the bytecode VM keeps its call
+            # stack on the heap, so deep recursion in the program needs no
+            # more of the recursion limit than parsing it did
+            actual_output = Interpreter(vm=True).execute(parse)
         # read the expected output
         out_path = lang_path.parent.joinpath(lang_path.stem + '.out')
         with out_path.open() as fd:
@@ -165,13 +158,14 @@ def test_with_file(lang_path, interpreter_only, parser_only, transform):
                 print('no sexp (empty file)')
                 return
             expected_sexp = normalize_sexp(contents)
+        raise_recursion_limit(expected_sexp)
         # process the expected and actual output to deal with whtiespace
         parse = sexp_to_parse(expected_sexp)
         assert validate_parse(parse), 'Invalid sexp parse: %s'%parse
         assert expected_sexp == str(parse), 'Sexp parse does not match expected sexp: %s'%parse
         print(f'sExp {expected_sexp}')
         # run the sexp
-        actual_output = Interpreter().execute(parse)
+        actual_output = Interpreter(vm=True).execute(parse)
         # read the expected output
         out_path = lang_path.parent.joinpath(lang_path.stem + '.out')
         with out_path.open() as fd:
@@ -189,8 +183,7 @@ def test_with_file(lang_path, interpreter_only, parser_only, transform):
             lines.append(actual_output)
             assert actual_output == expected_output, '\n'.join(lines)
     else:
-        parser = Parser()
-        parse = parser.parse(program, 'program')
+        parse = parse_program(program, cache, tokens)
         if parse is None:
             # if there's a syntax error, that's our only output
             actual_output = 'syntax error'
@@ -215,24 +208,96 @@ def test_with_file(lang_path, interpreter_only, parser_only, transform):
             sexp_path = lang_path.parent.joinpath(lang_path.stem + '.sexp')
             test_sexp(sexp_path, parse, 'intermediate representation does not match')
 
-def test_with_directory(dir_path, interpreter_only, parser_only, transform):
+def directory_paths(dir_path):
+    """List the lang programs in the directory in the order they are tested."""
+    return sorted(dir_path.glob('**/*.lang'), key=(lambda path: str(path).lower()))
+
+def test_with_directory(dir_path, interpreter_only, parser_only, transform, cache=None, tokens=False):
     """Test using the lang programs in the directory.
 
     Arguments:
         dir_path (Path): A directory containing input programs.
     """
-    for lang_path in sorted(dir_path.glob('**/*.lang'), key=(lambda path: str(path).lower())):
-        test_with_file(lang_path, interpreter_only, parser_only, transform)
+    for lang_path in directory_paths(dir_path):
+        test_with_file(lang_path, interpreter_only, parser_only, transform, cache, tokens)
+
+def run_test(task):
+    """Run one test in a worker process, catching its failure.
+
+    Parameters:
+        task (tuple): The lang path, the three mode flags, the cache
+            directory and version (None when there is no cache) and
+            whether to parse tokens.
+
+    Returns:
+        tuple: The lang path, the failure message (None if the test passed),
+            the seconds taken and the cache's (hits, misses, writes).
+    """
+    (lang_path, interpreter_only, parser_only, transform, cache_directory, cache_version, tokens) = task
+    cache = None
+    if (cache_directory is not None):
+        cache = CompileCache(cache_directory, cache_version)
+    failure = None
+    start = time.perf_counter()
+    try:
+        # the programs and parses test_with_file prints would interleave
+        with contextlib.redirect_stdout(io.StringIO()):
+            test_with_file(lang_path, interpreter_only, parser_only, transform, cache, tokens)
+    except AssertionError as error:
+        failure = str(error).strip() or 'assertion failed'
+    except Exception:
+        failure = traceback.format_exc()
+    seconds = time.perf_counter() - start
+    counters = (0, 0, 0) if cache is None else (cache.hits, cache.misses, cache.writes)
+    return (lang_path, failure, seconds, counters)
+
+def test_in_parallel(lang_paths, jobs, interpreter_only, parser_only, transform, cache=None, tokens=False):
+    """Test the lang programs in a pool of processes, continuing past failures.
+
+    Every file is reported with its time in test order, then every failure
+    in sorted order.
+
+    Parameters:
+        lang_paths (list): The paths of the input programs.
+        jobs (int): The number of processes to use.
+
+    Returns:
+        bool: Whether every test passed.
+    """
+    cache_directory = None if cache is None else str(cache.directory)
+    cache_version = None if cache is None else cache.version
+    tasks = [(lang_path, interpreter_only, parser_only, transform, cache_directory, cache_version, tokens) for lang_path in lang_paths]
+    failures = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(jobs) as executor:
+        chunksize = max(1, len(tasks) // (jobs * 8))
+        for (lang_path, failure, seconds, counters) in executor.map(run_test, tasks, chunksize=chunksize):
+            print('%s %s (%.3fs)'%('ok  ' if failure is None else 'FAIL', lang_path, seconds))
+            if (failure is not None):
+                failures.append((str(lang_path), failure))
+            if (cache is not None):
+                cache.hits += counters[0]
+                cache.misses += counters[1]
+                cache.writes += counters[2]
+    elapsed = time.perf_counter() - start
+    for (lang_path, failure) in sorted(failures):
+        print()
+        print(f'FAILED {lang_path}')
+        print(failure)
+    print()
+    print('%d passed, %d failed in %.2fs with %d processes'%(len(tasks) - len(failures), len(failures), elapsed, jobs))
+    return len(failures) == 0
 
 
 def main():
     """Run command line tests."""
-    # set recursion limit to be really high
-    sys.setrecursionlimit(10**6)
     n = 1
     interpreter_only = False
     parser_only = False
     transform = False
+    cache = None
+    jobs = None
+    tokens = False
 
     if (len(sys.argv) > 1 and sys.argv[1] == '-i'):
         n+=1
@@ -243,13 +308,41 @@ def main():
     if (len(sys.argv) > 1 and sys.argv[1] == '-t'):
         n+=1
         transform = True
-
-    for arg in sys.argv[n:]:
-        path = Path(arg).expanduser().resolve()
-        if path.is_dir():
-            test_with_directory(path, interpreter_only, parser_only, transform)
+    while (len(sys.argv) > n + 1 and sys.argv[n] in ('--cache', '-j', '--tokens')):
+        if (sys.argv[n] == '--tokens'):
+            # parse the token stream from lexer.Lexer with TokenParser
+            tokens = True
+            n += 1
+            continue
+        if (sys.argv[n] == '--cache'):
+            # parses are kept in this directory between runs; python cache.py
+            # clear <directory> empties it
+            cache = CompileCache(sys.argv[n + 1])
         else:
-            test_with_file(path, interpreter_only, parser_only, transform)
+            # run the files in this many processes and report every failure
+            # instead of stopping at the first
+            jobs = int(sys.argv[n + 1])
+        n += 2
+
+    if (jobs is None):
+        for arg in sys.argv[n:]:
+            path = Path(arg).expanduser().resolve()
+            if path.is_dir():
+                test_with_directory(path, interpreter_only, parser_only, transform, cache, tokens)
+            else:
+                test_with_file(path, interpreter_only, parser_only, transform, cache, tokens)
+    else:
+        lang_paths = []
+        for arg in sys.argv[n:]:
+            path = Path(arg).expanduser().resolve()
+            if path.is_dir():
+                lang_paths.extend(directory_paths(path))
+            else:
+                lang_paths.append(path)
+        if (not test_in_parallel(lang_paths, jobs, interpreter_only, parser_only, transform, cache, tokens)):
+            if (cache is not None):
+                print(cache.report())
+            sys.exit(1)
 
     print()
     if (interpreter_only):
@@ -261,6 +354,8 @@ def main():
             print("interpreter, parser, and transforms passed all test cases")
         else:
             print("interpreter and parser passed all test cases")
+    if (cache is not None):
+        print(cache.report())
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,79 @@
+class Output:
+    """Buffered program output.
+
+    Printed lines are collected in a list. Without a target they are kept
+    until text() joins them once; with a target they are handed over every
+    buffer_size lines, so a long running program streams its output with a
+    bounded amount held in memory. A target is a path, anything with a
+    write method (a file or stream), or a callable taking a chunk of text.
+    A path is opened when lines are first sent to it, emptying the file,
+    and close() flushes and closes it; lines written after that are
+    appended to the file, which is opened again.
+    """
+
+    def __init__(self, target=None, buffer_size=256):
+        self.__lines = []
+        self.__buffer_size = buffer_size
+        self.__path = None
+        self.__file = None
+        self.__send = None
+        if (isinstance(target, str)):
+            self.__path = target
+            self.__mode = 'w'
+            self.__send = self.__open
+        elif (hasattr(target, 'write')):
+            self.__send = target.write
+        elif (callable(target)):
+            self.__send = target
+
+    def write(self, line):
+        self.__lines.append(line)
+        if (self.__send is not None and len(self.__lines) >= self.__buffer_size):
+            self.flush()
+
+    def flush(self):
+        if (self.__send is not None and len(self.__lines) > 0):
+            self.__send('\n'.join(self.__lines) + '\n')
+            self.__lines = []
+
+    def text(self):
+        """Return everything written so far, or '' when it went to a target."""
+        self.flush()
+        return '\n'.join(self.__lines)
+
+    def close(self):
+        self.flush()
+        if (self.__path is not None and self.__file is None and self.__mode == 'w'):
+            # nothing was printed, but the file is still emptied
+            self.__open('')
+        if (self.__file is not None):
+            self.__file.close()
+            self.__file = None
+            self.__send = self.__open
+
+    def __open(self, text):
+        self.__file = open(self.__path, self.__mode)
+        self.__mode = 'a'
+        self.__send = self.__file.write
+        self.__send(text)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+def main():
+    import sys
+    from interpreter import Interpreter
+    from parser import Parser
+
+    program = Parser().parse('var i = 0;\nwhile (i < 10) {\n  print i * i;\n  i = i + 1;\n}\n', 'program')
+    print(repr(Interpreter().execute(program)))
+    chunks = []
+    Interpreter(output=chunks.append).execute(program)
+    print(chunks)
+    Interpreter(output=sys.stdout).execute(program)
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,38 @@
 class Parse:
+    # nodes of these types only group their children; they are spliced into
+    # their parent when the tree is printed or normalized
+    LABELS = ['func', 'var', 'int', 'integer', 'program tail', 'argument tail', 'parameter tail', '']
+
+    # every node type is numbered the first time it is seen; nodes keep the
+    # number as their kind, and their type is the string it stands for
+    KINDS = []
+    KIND_IDS = {}
+
+    __slots__ = ('kind', 'index', 'children')
+
+    @staticmethod
+    def kind_of(type):
+        kind = Parse.KIND_IDS.get(type)
+        if (kind is None):
+            kind = len(Parse.KINDS)
+            Parse.KINDS.append(type)
+            Parse.KIND_IDS[type] = kind
+        return kind
 
     def __init__(self, type, index, *children):
-        self.type = type
+        kind = Parse.KIND_IDS.get(type)
+        if (kind is None):
+            kind = Parse.kind_of(type)
+        self.kind = kind
         self.index = index
         self.children = children
 
+    @property
+    def type(self):
+        return Parse.KINDS[self.kind]
+
     def __eq__(self, other):
-        if (not (isinstance(other, Parse) and self.index == other.index and self.type == other.type)):
+        if (not (isinstance(other, Parse) and self.index == other.index and self.kind == other.kind)):
             return False
         for child, otherChild in zip(self.children, other.children):
             if (child != otherChild):
@@ -14,15 +40,28 @@ class Parse:
         return True
 
     def __str__(self):
-        labels = ['func', 'var', 'int', 'integer', 'program tail', 'argument tail', 'parameter tail', '']
-        if self.type in labels:
-            string = ''
-            for child in self.children:
-                string += str(child) + ' '
-            string = string[:-1]
-        else:
-            string = '(%s '%self.type
-            for child in self.children:
-                string += str(child) + ' '
-            string = string[:-1] + ')'
-        return string
+        # written with an explicit stack so printing is linear in the size of
+        # the tree instead of copying every subtree's string into its parent
+        pieces = []
+        stack = [self]
+        labels = LABEL_KINDS
+        while (len(stack) > 0):
+            item = stack.pop()
+            if (not isinstance(item, Parse)):
+                pieces.append(str(item))
+                continue
+            children = item.children
+            if (item.kind in labels):
+                for i in range(len(children) - 1, -1, -1):
+                    stack.append(children[i])
+                    if (i > 0):
+                        stack.append(' ')
+            else:
+                stack.append(')')
+                for i in range(len(children) - 1, -1, -1):
+                    stack.append(children[i])
+                    stack.append(' ')
+                stack.append('(' + item.type)
+        return ''.join(pieces)
+
+LABEL_KINDS = frozenset(Parse.kind_of(label) for label in Parse.LABELS)
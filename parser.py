@@ -1,41 +1,103 @@
 import parser
 import types
-from parse import Parse
+from lexer import Lexer
+from parse import LABEL_KINDS, Parse
 from sexp import sexp
 
 class Parser:
     FAIL = Parse('',-1)
     KEYWORDS = ['print', 'var', 'if', 'else', 'while', 'func', 'ret', 'class', 'int', 'bool', 'string']
 
-    def __init__(self):
+    def __init__(self, cache_size=None, check=False, share=None, positions=False):
+        # cache_size bounds the number of memoized results kept for one input;
+        # None keeps every result so each (rule, position) is parsed once.
+        # check compares every result against the old str()/sexp() round trip.
+        # share is a sharing.ParseTable that builds the returned tree.
+        # positions gives every node of the returned tree the offset in the
+        # program where the rule that made it (or its nearest ancestor's)
+        # started, instead of 0
         self._cache = dict()
+        self._share = share
+        self._positions = positions
+        self._starts = dict() # id of a rule's result -> (start index, result)
+        self._cache_size = cache_size
+        self._check = check
         self._string = None
+        self._rules = dict()
+        for name in dir(self):
+            if name.startswith('_parse_'):
+                self._rules[name[len('_parse_'):]] = (len(self._rules), getattr(self, name))
+        self._rule_count = len(self._rules)
 
     def parse(self, string, term):
-        parsed = self._parse(string, term, 0)
-        if parsed == Parser.FAIL:
+        parsed = self._parse(self._prepare(string), term, 0)
+        if parsed is Parser.FAIL:
             return None
-        if parsed.index < len(string) - 1:
+        if self._offset(parsed.index) < len(string) - 1:
             return None
-        parsed = sexp(str(parsed))
-        return parsed
+        normalized = self._normalize(parsed)
+        self._starts = dict()
+        if (len(normalized) != 1):
+            return None
+        if (self._check):
+            expected = sexp(str(parsed))
+            # a tree read back from its text has no positions to compare
+            same = self._positions or normalized[0] == expected
+            if (not (same and str(normalized[0]) == str(expected))):
+                raise AssertionError('Normalized parse %s does not match %s'%(normalized[0], expected))
+        return normalized[0]
+
+    def _normalize(self, parse, start=0):
+        # rebuild the tree the way printing and rereading it would: label nodes
+        # and empty strings are spliced into their parent, indices are reset
+        # (or set to the node's position)
+        if (not isinstance(parse, Parse)):
+            if (parse == ''):
+                return []
+            return [parse]
+        if (self._positions):
+            start = self._starts.get(id(parse), (start,))[0]
+        children = []
+        for child in parse.children:
+            children.extend(self._normalize(child, start))
+        if (parse.kind in LABEL_KINDS):
+            return children
+        index = self._offset(start) if self._positions else 0
+        if (self._share is not None):
+            return [self._share.node(parse.type, index, *children)]
+        return [Parse(parse.type, index, *children)]
 
     def _parse(self, string, term, index):
-        if (self._string != string):
+        if (self._string is not string):
             self._cache = dict()
-        if ((term, index) in self._cache):
-            return self._cache[(term, index)]
-        nonterminal = getattr(self, '_parse_%s'%term, None)
-        if (not callable(nonterminal)):
+            self._string = string
+        rule = self._rules.get(term)
+        if (rule is None):
             raise AssertionError('Unexpected term %s'%term)
-        result = nonterminal(string, index)
-        self._cache[(term,index)] = result
+        key = index * self._rule_count + rule[0]
+        result = self._cache.get(key)
+        if (result is not None):
+            return result
+        result = rule[1](string, index)
+        self._cache[key] = result
+        if (self._positions and result is not Parser.FAIL):
+            self._starts[id(result)] = (index, result)
+        if (self._cache_size is not None and len(self._cache) > self._cache_size):
+            del self._cache[next(iter(self._cache))]
         return result
 
+    def _prepare(self, string):
+        # the input handed to the rules; the character parser reads the string itself
+        return string
+
+    def _offset(self, index):
+        # the character offset in the program corresponding to a rule index
+        return index
+
     def _zero_or_more(self, string, index, term):
         parsed = []
         result = self._parse(string, term, index)
-        while (result != Parser.FAIL):
+        while (result is not Parser.FAIL):
             index = result.index
             parsed.append(result)
             result = self._parse(string, term, index)
@@ -43,7 +105,7 @@ class Parser:
 
     def _one_or_more(self, string, index, term):
         first = self._parse(string, term, index)
-        if (first == Parser.FAIL):
+        if (first is Parser.FAIL):
             return Parser.FAIL
         index = first.index
         rest = self._zero_or_more(string, index, term)
@@ -51,23 +113,22 @@ class Parser:
 
     def _zero_or_one(self, string, index, term):
         parse = self._parse(string, term, index)
-        if (parse == Parser.FAIL):
+        if (parse is Parser.FAIL):
             return []
         return [parse]
 
     def _choose(self, string, index, *terms):
         for term in terms:
             result = self._parse(string, term, index)
-            if (result != Parser.FAIL):
+            if (result is not Parser.FAIL):
                 return result
         return Parser.FAIL
 
     def _choose_chars(self, string, index, *terms):
         for term in terms:
             result = self._string_term(string, index, term)
-            if (result != Parser.FAIL):
-                result.type = term
-                return result
+            if (result is not Parser.FAIL):
+                return Parse(term, result.index)
         return Parser.FAIL
 
     def _character(self, string, index, character):
@@ -80,13 +141,9 @@ class Parser:
     def _string_term(self, string, index, word):
         if (index >= len(string)):
             return Parser.FAIL
-        i = index
-        for char in word:
-            if string[i] != char:
-                return Parser.FAIL
-            i += 1
-        index = i
-        return Parse('string', index)
+        if (not string.startswith(word, index)):
+            return Parser.FAIL
+        return Parse('string', index + len(word))
 
     def _parse_program(self, string, index):
         leading_space = self._parse(string, 'opt_space', index)
@@ -98,13 +155,11 @@ class Parser:
             return Parse('sequence', index)
         trailing_space = self._parse(string, 'opt_space', index)
         index = trailing_space.index
-        parse = Parse('sequence', index)
-        parse.children = program
-        return parse
+        return Parse('sequence', index, *program)
 
     def _parse_program_tail(self, string, index):
         statement = self._parse(string, 'statement', index)
-        if statement == Parser.FAIL:
+        if statement is Parser.FAIL:
             return Parser.FAIL
         index = statement.index
         space = self._parse(string, 'opt_space', index)
@@ -116,21 +171,21 @@ class Parser:
 
     def _parse_print_statement(self, string, index):
         p = self._string_term(string, index, 'print')
-        if p == Parser.FAIL:
+        if p is Parser.FAIL:
             return Parser.FAIL
         index = p.index
         space = self._parse(string, 'req_space', index)
-        if space == Parser.FAIL:
+        if space is Parser.FAIL:
             return Parser.FAIL
         index = space.index
         expression = self._parse(string, 'expression', index)
-        if expression == Parser.FAIL:
+        if expression is Parser.FAIL:
             return Parser.FAIL
         index = expression.index
         opt_space = self._parse(string, 'opt_space', index)
         index = opt_space.index
         semicolon = self._character(string, index, ';')
-        if semicolon == Parser.FAIL:
+        if semicolon is Parser.FAIL:
             return Parser.FAIL
         index = semicolon.index
 
@@ -139,7 +194,7 @@ class Parser:
     def _parse_expression_statement(self, string, index):
         startingIndex = index
         exp = self._parse(string, 'expression', index)
-        if exp == Parser.FAIL:
+        if exp is Parser.FAIL:
             return Parser.FAIL
         index = exp.index
 
@@ -147,28 +202,27 @@ class Parser:
         index = space.index
 
         semicolon = self._character(string, index, ';')
-        if semicolon == Parser.FAIL:
+        if semicolon is Parser.FAIL:
             return Parser.FAIL
-        exp.index = semicolon.index
-        return exp
+        return Parse(exp.type, semicolon.index, *exp.children)
 
     def _parse_return_statement(self, string, index):
         ret = self._string_term(string, index, 'ret')
-        if ret == Parser.FAIL:
+        if ret is Parser.FAIL:
             return Parser.FAIL
         index = ret.index
         space1 = self._parse(string, 'req_space', index)
-        if space1 == Parser.FAIL:
+        if space1 is Parser.FAIL:
             return Parser.FAIL
         index = space1.index
         exp = self._parse(string, 'expression', index)
-        if exp == Parser.FAIL:
+        if exp is Parser.FAIL:
             return Parser.FAIL
         index = exp.index
         space2 = self._parse(string, 'opt_space', index)
         index = space2.index
         semicolon = self._character(string, index, ';')
-        if semicolon == Parser.FAIL:
+        if semicolon is Parser.FAIL:
             return Parser.FAIL
         index += 1
         return Parse('return', index, exp)
@@ -179,7 +233,7 @@ class Parser:
 
     def _parse_or_expression(self, string, index):
         and_exp = self._parse(string, 'and_expression', index)
-        if and_exp == Parser.FAIL:
+        if and_exp is Parser.FAIL:
             return Parser.FAIL
         index = and_exp.index
 
@@ -193,12 +247,12 @@ class Parser:
 
     def _parse_or_tail(self, string, index):
         operator = self._parse(string, 'or_operator', index)
-        if operator == Parser.FAIL:
+        if operator is Parser.FAIL:
             return Parser.FAIL
         index = operator.index
 
         exp = self._parse(string, 'and_expression', index)
-        if exp == Parser.FAIL:
+        if exp is Parser.FAIL:
             return Parser.FAIL
         index = exp.index
 
@@ -206,7 +260,7 @@ class Parser:
 
     def _parse_and_expression(self, string, index):
         opt_not = self._parse(string, 'opt_not_expression', index)
-        if opt_not == Parser.FAIL:
+        if opt_not is Parser.FAIL:
             return Parser.FAIL
         index = opt_not.index
 
@@ -221,12 +275,12 @@ class Parser:
 
     def _parse_and_tail(self, string, index):
         operator = self._parse(string, 'and_operator', index)
-        if operator == Parser.FAIL:
+        if operator is Parser.FAIL:
             return Parser.FAIL
         index = operator.index
 
         exp = self._parse(string, 'opt_not_expression', index)
-        if exp == Parser.FAIL:
+        if exp is Parser.FAIL:
             return Parser.FAIL
         index = exp.index
 
@@ -234,19 +288,19 @@ class Parser:
 
     def _parse_opt_not_expression(self, string, index):
         exp = self._choose(string, index, 'comp_expression', 'not_expression')
-        if exp == Parser.FAIL:
+        if exp is Parser.FAIL:
             return Parser.FAIL
         return exp
 
     def _parse_not_expression(self, string, index):
         exclamation = self._character(string, index, '!')
-        if exclamation == Parser.FAIL:
+        if exclamation is Parser.FAIL:
             return Parser.FAIL
         index += 1
         space = self._parse(string, 'opt_space', index)
         index = space.index
         comp_exp = self._parse(string, 'comp_expression', index)
-        if comp_exp == Parser.FAIL:
+        if comp_exp is Parser.FAIL:
             return Parser.FAIL
         index = comp_exp.index
 
@@ -255,7 +309,7 @@ class Parser:
 
     def _parse_comp_expression(self, string, index):
         add_sub = self._parse(string, 'add_expression', index)
-        if add_sub == Parser.FAIL:
+        if add_sub is Parser.FAIL:
             return Parser.FAIL
         index = add_sub.index
 
@@ -272,12 +326,12 @@ class Parser:
 
     def _parse_comp_tail(self, string, index):
         operator = self._parse(string, 'comp_operator', index)
-        if operator == Parser.FAIL:
+        if operator is Parser.FAIL:
             return Parser.FAIL
         index = operator.index
 
         exp = self._parse(string, 'add_expression', index)
-        if exp == Parser.FAIL:
+        if exp is Parser.FAIL:
             return Parser.FAIL
         index = exp.index
 
@@ -286,43 +340,43 @@ class Parser:
 
     def _parse_if_statement(self, string, index):
         _if = self._string_term(string, index, 'if')
-        if _if == Parser.FAIL:
+        if _if is Parser.FAIL:
             return Parser.FAIL
         index = _if.index
         space1 = self._parse(string, 'opt_space', index)
         index = space1.index
         open_paren = self._character(string, index, '(')
-        if open_paren == Parser.FAIL:
+        if open_paren is Parser.FAIL:
             return Parser.FAIL
         index = open_paren.index
         space2 = self._parse(string, 'opt_space', index)
         index = space2.index
         condition = self._parse(string, 'expression', index)
-        if condition == Parser.FAIL:
+        if condition is Parser.FAIL:
             return Parser.FAIL
         index = condition.index
         space3 = self._parse(string, 'opt_space', index)
         index = space3.index
         closed_paren = self._character(string, index, ')')
-        if closed_paren == Parser.FAIL:
+        if closed_paren is Parser.FAIL:
             return Parser.FAIL
         index = closed_paren.index
         space4 = self._parse(string, 'opt_space', index)
         index = space4.index
         open_bracket = self._character(string, index, '{')
-        if open_bracket == Parser.FAIL:
+        if open_bracket is Parser.FAIL:
             return Parser.FAIL
         index = open_bracket.index
         space5 = self._parse(string, 'opt_space', index)
         index = space5.index
         program = self._parse(string, 'program', index)
-        if program == Parser.FAIL:
+        if program is Parser.FAIL:
             return Parser.FAIL
         index = program.index
         space6 = self._parse(string, 'opt_space', index)
         index = space6.index
         closed_bracket = self._character(string, index, '}')
-        if closed_bracket == Parser.FAIL:
+        if closed_bracket is Parser.FAIL:
             return Parser.FAIL
         index = closed_bracket.index
 
@@ -330,67 +384,67 @@ class Parser:
 
     def _parse_ifelse_statement(self, string, index):
         _if = self._string_term(string, index, 'if')
-        if _if == Parser.FAIL:
+        if _if is Parser.FAIL:
             return Parser.FAIL
         index = _if.index
         space1 = self._parse(string, 'opt_space', index)
         index = space1.index
         open_paren = self._character(string, index, '(')
-        if open_paren == Parser.FAIL:
+        if open_paren is Parser.FAIL:
             return Parser.FAIL
         index = open_paren.index
         space2 = self._parse(string, 'opt_space', index)
         index = space2.index
         condition = self._parse(string, 'expression', index)
-        if condition == Parser.FAIL:
+        if condition is Parser.FAIL:
             return Parser.FAIL
         index = condition.index
         space3 = self._parse(string, 'opt_space', index)
         index = space3.index
         closed_paren = self._character(string, index, ')')
-        if closed_paren == Parser.FAIL:
+        if closed_paren is Parser.FAIL:
             return Parser.FAIL
         index = closed_paren.index
         space4 = self._parse(string, 'opt_space', index)
         index = space4.index
         open_bracket = self._character(string, index, '{')
-        if open_bracket == Parser.FAIL:
+        if open_bracket is Parser.FAIL:
             return Parser.FAIL
         index = open_bracket.index
         space5 = self._parse(string, 'opt_space', index)
         index = space5.index
         if_program = self._parse(string, 'program', index)
-        if if_program == Parser.FAIL:
+        if if_program is Parser.FAIL:
             return Parser.FAIL
         index = if_program.index
         space6 = self._parse(string, 'opt_space', index)
         index = space6.index
         closed_bracket = self._character(string, index, '}')
-        if closed_bracket == Parser.FAIL:
+        if closed_bracket is Parser.FAIL:
             return Parser.FAIL
         index = closed_bracket.index
         space7 = self._parse(string, 'opt_space', index)
         index = space7.index
         _else = self._string_term(string, index, 'else')
-        if _else == Parser.FAIL:
+        if _else is Parser.FAIL:
             return Parser.FAIL
         index = _else.index
         space8 = self._parse(string, 'opt_space', index)
         index = space8.index
         open_bracket = self._character(string, index, '{')
-        if open_bracket == Parser.FAIL:
+        if open_bracket is Parser.FAIL:
             return Parser.FAIL
         index = open_bracket.index
         space9 = self._parse(string, 'opt_space', index)
         index = space9.index
         else_program = self._parse(string, 'program', index)
-        if else_program == Parser.FAIL:
+        if else_program is Parser.FAIL:
             return Parser.FAIL
         index = else_program.index
         space10 = self._parse(string, 'opt_space', index)
         index = space10.index
         closed_bracket = self._character(string, index, '}')
-        if closed_bracket == Parser.FAIL:
+        if closed_bracket is Parser.FAIL:
             return Parser.FAIL
         index = closed_bracket.index
 
@@ -398,43 +452,43 @@ class Parser:
 
     def _parse_while_statement(self, string, index):
         _while = self._string_term(string, index, 'while')
-        if _while == Parser.FAIL:
+        if _while is Parser.FAIL:
             return Parser.FAIL
         index = _while.index
         space1 = self._parse(string, 'opt_space', index)
         index = space1.index
         open_paren = self._character(string, index, '(')
-        if open_paren == Parser.FAIL:
+        if open_paren is Parser.FAIL:
             return Parser.FAIL
         index = open_paren.index
         space2 = self._parse(string, 'opt_space', index)
         index = space2.index
         condition = self._parse(string, 'expression', index)
-        if condition == Parser.FAIL:
+        if condition is Parser.FAIL:
             return Parser.FAIL
         index = condition.index
         space3 = self._parse(string, 'opt_space', index)
         index = space3.index
         closed_paren = self._character(string, index, ')')
-        if closed_paren == Parser.FAIL:
+        if closed_paren is Parser.FAIL:
             return Parser.FAIL
         index = closed_paren.index
         space4 = self._parse(string, 'opt_space', index)
         index = space4.index
         open_bracket = self._character(string, index, '{')
-        if open_bracket == Parser.FAIL:
+        if open_bracket is Parser.FAIL:
             return Parser.FAIL
         index = open_bracket.index
         space5 = self._parse(string, 'opt_space', index)
         index = space5.index
         body = self._parse(string, 'program', index)
-        if body == Parser.FAIL:
+        if body is Parser.FAIL:
             return Parser.FAIL
         index = body.index
         space6 = self._parse(string, 'opt_space', index)
         index = space6.index
         closed_bracket = self._character(string, index, '}')
-        if closed_bracket == Parser.FAIL:
+        if closed_bracket is Parser.FAIL:
             return Parser.FAIL
         index = closed_bracket.index
 
@@ -443,30 +497,28 @@ class Parser:
 
     def _parse_parenthesized_expression(self, string, index):
         parenthesis = self._character(string, index, '(')
-        if (parenthesis == Parser.FAIL):
+        if (parenthesis is Parser.FAIL):
             return Parser.FAIL
         index += 1
         space1 = self._parse(string, 'opt_space', index)
         index = space1.index
         expression = self._parse(string, 'expression', index)
-        if (expression == Parser.FAIL):
+        if (expression is Parser.FAIL):
             return Parser.FAIL
         index = expression.index
         space1 = self._parse(string, 'opt_space', index)
         index = space1.index
 
         parenthesis = self._character(string, index, ')')
-        if (parenthesis == Parser.FAIL):
+        if (parenthesis is Parser.FAIL):
             return Parser.FAIL
         index += 1
 
-        expression.index = index
-
-        return expression
+        return Parse(expression.type, index, *expression.children)
 
     def _parse_add_expression(self, string, index):
         mul_div_expression = self._parse(string, 'mul_div_expression', index)
-        if (mul_div_expression == Parser.FAIL):
+        if (mul_div_expression is Parser.FAIL):
             return Parser.FAIL
         index = mul_div_expression.index
 
@@ -481,12 +533,12 @@ class Parser:
 
     def _parse_add_tail(self, string, index):
         operator = self._choose(string, index, 'add_operator', 'sub_operator')
-        if (operator == Parser.FAIL):
+        if (operator is Parser.FAIL):
             return Parser.FAIL
         index = operator.index
 
         mul_div_expression = self._parse(string, 'mul_div_expression', index)
-        if (mul_div_expression == Parser.FAIL):
+        if (mul_div_expression is Parser.FAIL):
             return Parser.FAIL
         index = mul_div_expression.index
 
@@ -494,7 +546,7 @@ class Parser:
 
     def _parse_mul_div_expression(self, string, index):
         call = self._parse(string, 'call_expression', index)
-        if (call == Parser.FAIL):
+        if (call is Parser.FAIL):
             return Parser.FAIL
         index = call.index
         space = self._parse(string, 'opt_space', index)
@@ -508,29 +560,29 @@ class Parser:
 
     def _parse_mul_tail(self, string, index):
         operator = self._choose(string, index, 'mul_operator', 'div_operator')
-        if (operator == Parser.FAIL):
+        if (operator is Parser.FAIL):
             return Parser.FAIL
         index = operator.index
         space = self._parse(string, 'opt_space', index)
         index = space.index
         call = self._parse(string, 'call_expression', index)
-        if (call == Parser.FAIL):
+        if (call is Parser.FAIL):
             return Parser.FAIL
         index = call.index
         return Parse('mul tail', index, operator.type, call)
 
     def _parse_assignment_statement(self, string, index):
         location = self._parse(string, 'identifier', index)
-        if (location == Parser.FAIL):
+        if (location is Parser.FAIL):
             return Parser.FAIL
-        location.type = 'varloc'
+        location = Parse('varloc', location.index, *location.children)
         index = location.index
 
         space = self._parse(string, 'opt_space', index)
         index = space.index
 
         equals = self._character(string, index, '=')
-        if (equals == Parser.FAIL):
+        if (equals is Parser.FAIL):
             return Parser.FAIL
         index = equals.index
 
@@ -538,7 +590,7 @@ class Parser:
         index = space.index
 
         expression = self._parse(string, 'expression', index)
-        if (expression == Parser.FAIL):
+        if (expression is Parser.FAIL):
             return Parser.FAIL
         index = expression.index
 
@@ -546,57 +598,55 @@ class Parser:
         index = space.index
 
         semicolon = self._character(string, index, ';')
-        if (semicolon == Parser.FAIL):
+        if (semicolon is Parser.FAIL):
             return Parser.FAIL
         index = semicolon.index
 
         return Parse('assign', index, location, expression)
 
     def _parse_identifier(self, string, index):
+        start = index
         first = self._choose(string, index, 'alpha', 'underscore')
-        if (first == Parser.FAIL):
+        if (first is Parser.FAIL):
             return Parser.FAIL
         index = first.index
         id_tails = self._zero_or_more(string, index, 'identifier_tail')
-        identifier = string[index - 1]
         if (len(id_tails) > 0):
             last_index = id_tails[len(id_tails) - 1].index
         else:
             last_index = index
-        for tail in id_tails:
-            if tail.children[0].index > last_index:
-                break
-            identifier += string[tail.children[0].index -1]
+        identifier = string[start:last_index]
         if identifier in Parser.KEYWORDS:
             return Parser.FAIL
         return Parse('lookup', last_index, identifier)
 
     def _parse_identifier_tail(self, string, index):
         id_char = self._choose(string, index, 'alpha', 'integer', 'underscore')
-        if (id_char == Parser.FAIL):
+        if (id_char is Parser.FAIL):
             return Parser.FAIL
         index = id_char.index
         return Parse('identifier tail', index, id_char)
 
     def _parse_declaration_statement(self, string, index):
         word = self._parse(string, 'type', index)
-        if (word == Parser.FAIL):
+        if (word is Parser.FAIL):
             return Parser.FAIL
-        if word.type == 'var':
-            word.type = ''
+        word_type = word.type
+        if word_type == 'var':
+            word_type = ''
         index = word.index
 
         space = self._parse(string, 'req_space', index)
-        if (space == Parser.FAIL):
+        if (space is Parser.FAIL):
             return Parser.FAIL
         index = space.index
 
         assignment_statement = self._parse(string, 'assignment_statement', index)
-        if (assignment_statement == Parser.FAIL):
+        if (assignment_statement is Parser.FAIL):
             return Parser.FAIL
         index = assignment_statement.index
-        assignment_statement.children[0].type = ''
-        return Parse('declare', index, word.type, assignment_statement.children[0], assignment_statement.children[1])
+        (location, expression) = assignment_statement.children
+        return Parse('declare', index, word_type, Parse('', location.index, *location.children), expression)
 
     def _parse_parameters(self, string, index):
         leading_space = self._parse(string, 'opt_space', index)
@@ -609,13 +659,11 @@ class Parser:
         index = params[len(params)-1].index
         trailing_space = self._parse(string, 'opt_space', index)
         index = trailing_space.index
-        parsed = Parse('parameters', params[0].index)
-        parsed.children =  params[0].children
-        return parsed
+        return Parse('parameters', index, *params[0].children)
 
     def _parse_parameters_inner(self, string, index):
         identifier = self._parse(string, 'parameter', index)
-        if identifier == Parser.FAIL:
+        if identifier is Parser.FAIL:
             return Parser.FAIL
         index = identifier.index
 
@@ -626,14 +674,13 @@ class Parser:
         param_tails.insert(0, identifier)
         for tail in param_tails:
             index = tail.index
-        parsed = Parse('parameters inner', index)
-        parsed.children = param_tails
+        parsed = Parse('parameters inner', index, *param_tails)
         
         return parsed
 
     def _parse_parameter_tail(self, string, index):
         comma = self._character(string, index, ',')
-        if comma == Parser.FAIL:
+        if comma is Parser.FAIL:
             return Parser.FAIL
         index += 1
 
@@ -641,7 +688,7 @@ class Parser:
         index = leading_space.index
 
         identifier = self._parse(string, 'parameter', index)
-        if identifier == Parser.FAIL:
+        if identifier is Parser.FAIL:
             return Parser.FAIL
         index = identifier.index
 
@@ -654,41 +701,41 @@ class Parser:
         if len(p_type) != 0:
             index = p_type[0].index
         identifier = self._parse(string, 'identifier', index)
-        if identifier == Parser.FAIL:
+        if identifier is Parser.FAIL:
             return Parser.FAIL
         index = identifier.index
-        identifier.type = ''
+        identifier = Parse('', identifier.index, *identifier.children)
         if len(p_type)==0:
             return Parse(identifier.type, index, identifier)
         return Parse(p_type[0].type, index, identifier)
     
     def _parse_param_type(self, string, index):
         p_type = self._parse(string, 'type', index)
-        if p_type == Parser.FAIL:
+        if p_type is Parser.FAIL:
             return Parser.FAIL
         index = p_type.index
         space = self._parse(string, 'req_space', index)
-        if space == Parser.FAIL:
+        if space is Parser.FAIL:
             return Parser.FAIL
         index = space.index
         return Parse(p_type.type, index)
 
     def _parse_type(self, string, index):
         t = self._choose_chars(string, index, 'func', 'int', 'var')
-        if t == Parser.FAIL:
+        if t is Parser.FAIL:
             return Parser.FAIL
         index = t.index
         return t
 
     def _parse_return_type(self, string, index):
         arrow = self._string_term(string, index, '->')
-        if arrow == Parser.FAIL:
+        if arrow is Parser.FAIL:
             return Parser.FAIL
         index = arrow.index
         space = self._parse(string, 'opt_space', index)
         index = space.index
         t = self._parse(string, 'type', index)
-        if t == Parser.FAIL:
+        if t is Parser.FAIL:
             return Parser.FAIL
         index = t.index
         return Parse('return type', index, t)
@@ -704,13 +751,11 @@ class Parser:
         index = args[len(args)-1].index
         trailing_space = self._parse(string, 'opt_space', index)
         index = trailing_space.index
-        parsed = Parse('arguments', args[0].index)
-        parsed.children =  args[0].children
-        return parsed
+        return Parse('arguments', index, *args[0].children)
 
     def _parse_arguments_inner(self, string, index):
         exp = self._parse(string, 'expression', index)
-        if exp == Parser.FAIL:
+        if exp is Parser.FAIL:
             return Parser.FAIL
         index = exp.index
 
@@ -721,14 +766,13 @@ class Parser:
         arg_tails.insert(0, exp)
         for tail in arg_tails:
             index = tail.index
-        parsed = Parse('arguments inner', index)
-        parsed.children = arg_tails
+        parsed = Parse('arguments inner', index, *arg_tails)
 
         return parsed
 
     def _parse_argument_tail(self, string, index):
         comma = self._character(string, index, ',')
-        if comma == Parser.FAIL:
+        if comma is Parser.FAIL:
             return Parser.FAIL
         index += 1
 
@@ -736,7 +780,7 @@ class Parser:
         index = leading_space.index
 
         exp = self._parse(string, 'expression', index)
-        if exp == Parser.FAIL:
+        if exp is Parser.FAIL:
             return Parser.FAIL
         index = exp.index
 
@@ -747,21 +791,21 @@ class Parser:
 
     def _parse_function(self, string, index):
         func = self._string_term(string, index, 'func')
-        if func == Parser.FAIL:
+        if func is Parser.FAIL:
             return Parser.FAIL
         index = func.index
         space1 = self._parse(string, 'opt_space', index)
         index = space1.index
         open_paren = self._character(string, index, '(')
-        if open_paren == Parser.FAIL:
+        if open_paren is Parser.FAIL:
             return Parser.FAIL
         index += 1
         params = self._parse(string, 'parameters', index)
-        if params == Parser.FAIL:
+        if params is Parser.FAIL:
             return Parser.FAIL
         index = params.index
         closed_paren = self._character(string, index, ')')
-        if closed_paren == Parser.FAIL:
+        if closed_paren is Parser.FAIL:
             return Parser.FAIL
         index += 1
         space2 = self._parse(string, 'opt_space', index)
@@ -772,15 +816,15 @@ class Parser:
         space3 = self._parse(string, 'opt_space', index)
         index = space3.index
         open_bracket = self._character(string, index, '{')
-        if open_bracket == Parser.FAIL:
+        if open_bracket is Parser.FAIL:
             return Parser.FAIL
         index += 1
         program = self._parse(string, 'program', index)
-        if program == Parser.FAIL:
+        if program is Parser.FAIL:
             return Parser.FAIL
         index = program.index
         closed_bracket = self._character(string, index, '}')
-        if closed_bracket == Parser.FAIL:
+        if closed_bracket is Parser.FAIL:
             return Parser.FAIL
         index += 1
 
@@ -791,41 +835,41 @@ class Parser:
             if len(ret_type) == 0:
                 ret_type.append(Parse('ret type', 0, Parse('var', 0)))
             types_list = []
+            children = []
             for child in params.children:
                 if child.type == '':
-                    child.type = 'var'
+                    child = Parse('var', child.index, *child.children)
+                children.append(child)
                 types_list.append(child.type)
+            params = Parse(params.type, params.index, *children)
             print("types list: " + str(types_list))
             types_list.append(ret_type[0].children[0].type)
-            sig = Parse('signature', index)
-            sig.children = types_list
+            sig = Parse('signature', index, *types_list)
             return Parse('function', index, sig, params, program)
         return Parse('function', index, params, program)
 
     def _parse_function_call(self, string, index):
         open_paren = self._character(string, index, '(')
-        if open_paren == Parser.FAIL:
+        if open_paren is Parser.FAIL:
             return Parser.FAIL
         index += 1
         space1 = self._parse(string, 'opt_space', index)
         index = space1.index
         args = self._parse(string, 'arguments', index)
-        if args == Parser.FAIL:
+        if args is Parser.FAIL:
             return Parser.FAIL
         index = args.index
         space2 = self._parse(string, 'opt_space', index)
         index = space2.index
         closed_paren = self._character(string, index, ')')
-        if closed_paren == Parser.FAIL:
+        if closed_paren is Parser.FAIL:
             return Parser.FAIL
         index += 1
-        parsed = Parse(args.type, index)
-        parsed.children = args.children
-        return parsed
+        return Parse(args.type, index, *args.children)
 
     def _parse_call_expression(self, string, index):
         operand = self._parse(string, 'operand', index)
-        if (operand == Parser.FAIL):
+        if (operand is Parser.FAIL):
             return Parser.FAIL
         index = operand.index
         space = self._parse(string, 'opt_space', index)
@@ -841,7 +885,7 @@ class Parser:
 
     def _parse_call_tail(self, string, index):
         call = self._parse(string, 'function_call', index)
-        if call == Parser.FAIL:
+        if call is Parser.FAIL:
             return Parser.FAIL
         index = call.index
         return Parse('call tail', index, call)
@@ -863,7 +907,7 @@ class Parser:
         index = leading_space.index
 
         operator = self._character(string, index, '-')
-        if (operator == Parser.FAIL):
+        if (operator is Parser.FAIL):
             return Parser.FAIL
         index += 1
 
@@ -876,7 +920,7 @@ class Parser:
         index = leading_space.index
 
         operator = self._character(string, index, '+')
-        if (operator == Parser.FAIL):
+        if (operator is Parser.FAIL):
             return Parser.FAIL
         index += 1
 
@@ -889,7 +933,7 @@ class Parser:
         index = leading_space.index
 
         operator = self._character(string, index, '*')
-        if (operator == Parser.FAIL):
+        if (operator is Parser.FAIL):
             return Parser.FAIL
         index += 1
 
@@ -902,7 +946,7 @@ class Parser:
         index = leading_space.index
 
         operator = self._character(string, index, '/')
-        if (operator == Parser.FAIL):
+        if (operator is Parser.FAIL):
             return Parser.FAIL
         index += 1
 
@@ -915,7 +959,7 @@ class Parser:
         index = leading_space.index
 
         operator = self._choose_chars(string, index, '==', '!=', '<=', '>=', '<', '>')
-        if (operator == Parser.FAIL):
+        if (operator is Parser.FAIL):
             return Parser.FAIL
         index = operator.index
 
@@ -928,9 +972,9 @@ class Parser:
         index = leading_space.index
 
         operator = self._string_term(string, index, '&&')
-        if (operator == Parser.FAIL):
+        if (operator is Parser.FAIL):
             return Parser.FAIL
-        index += 2
+        index = operator.index
 
         trailing_space = self._parse(string, 'opt_space', index)
         index = trailing_space.index
@@ -941,9 +985,9 @@ class Parser:
         index = leading_space.index
 
         operator = self._string_term(string, index, '||')
-        if (operator == Parser.FAIL):
+        if (operator is Parser.FAIL):
             return Parser.FAIL
-        index += 2
+        index = operator.index
 
         trailing_space = self._parse(string, 'opt_space', index)
         index = trailing_space.index
@@ -957,16 +1001,16 @@ class Parser:
 
     def _parse_req_space(self, string, index):
         space = self._one_or_more(string, index, 'whitespace')
-        if space == Parser.FAIL:
+        if space is Parser.FAIL:
             return Parser.FAIL
         index = space[len(space) - 1].index
         return Parse('whitespace', index)
 
     def _parse_whitespace(self, string, index):
         space = self._choose_chars(string, index, ' ', '\n', '\t')
-        if space == Parser.FAIL:
+        if space is Parser.FAIL:
             comment = self._parse(string, 'comment', index)
-            if (comment == Parser.FAIL):
+            if (comment is Parser.FAIL):
                 return Parser.FAIL
             else:
                 index = comment.index
@@ -976,14 +1020,16 @@ class Parser:
 
     def _parse_comment(self, string, index):
         pound = self._character(string, index, '#')
-        if pound == Parser.FAIL:
+        if pound is Parser.FAIL:
             return Parser.FAIL
         index += 1
 
-        while string[index] != '\n' and index < len(string):
+        while index < len(string) and string[index] != '\n':
             if index == len(string)-1:
                 return Parser.FAIL
             index += 1
+        if (index >= len(string)):
+            return Parser.FAIL
         index += 1
 
         return Parse('comment', index)
@@ -998,11 +1044,88 @@ class Parser:
 
     def _parse_underscore(self, string, index):
         underscore = self._character(string, index, '_')
-        if (underscore == Parser.FAIL):
+        if (underscore is Parser.FAIL):
             return Parser.FAIL
         index += 1
         return Parse('_', index)
 
+class TokenParser(Parser):
+    """Parser that runs the grammar over the token stream produced by Lexer.
+
+    Rule indices are token indices instead of character offsets. Whitespace
+    and comments are dropped by the lexer, so the spacing rules only check the
+    few places where the grammar cares whether tokens were separated.
+    """
+
+    def __init__(self, cache_size=None, check=False, share=None, positions=False):
+        super().__init__(cache_size, check, share, positions)
+        self._lexer = Lexer(Parser.KEYWORDS)
+        self._source = None
+
+    def _prepare(self, string):
+        self._source = string
+        return self._lexer.tokenize(string)
+
+    def _offset(self, index):
+        if (index < len(self._string)):
+            return self._string[index][2]
+        return len(self._source)
+
+    def _spaced(self, index):
+        # whether whitespace or a comment separates token index from the token before it
+        offset = self._offset(index)
+        return offset > 0 and self._source[offset - 1] in ' \n\t'
+
+    def _character(self, tokens, index, character):
+        if (index >= len(tokens)):
+            return Parser.FAIL
+        if (tokens[index][1] != character):
+            return Parser.FAIL
+        return Parse('character', index + 1)
+
+    def _string_term(self, tokens, index, word):
+        if (index >= len(tokens)):
+            return Parser.FAIL
+        if (tokens[index][1] != word):
+            return Parser.FAIL
+        return Parse('string', index + 1)
+
+    def _parse_call_expression(self, tokens, index):
+        operand = self._parse(tokens, 'operand', index)
+        if (operand is Parser.FAIL):
+            return Parser.FAIL
+        index = operand.index
+        tail = self._parse(tokens, 'call_tail', index)
+        if (tail is Parser.FAIL):
+            return Parse('', index, operand)
+        parsed = operand
+        while (tail is not Parser.FAIL):
+            index = tail.index
+            parsed = Parse('call', index, parsed, tail.children[0])
+            # only the first call may be separated from what it calls
+            if (self._spaced(index)):
+                break
+            tail = self._parse(tokens, 'call_tail', index)
+        return parsed
+
+    def _parse_identifier(self, tokens, index):
+        if (index >= len(tokens) or tokens[index][0] != Lexer.IDENTIFIER):
+            return Parser.FAIL
+        return Parse('lookup', index + 1, tokens[index][1])
+
+    def _parse_integer(self, tokens, index):
+        if (index >= len(tokens) or tokens[index][0] != Lexer.INTEGER):
+            return Parser.FAIL
+        return Parse('integer', index + 1, tokens[index][1])
+
+    def _parse_opt_space(self, tokens, index):
+        return Parse('whitespace', index)
+
+    def _parse_req_space(self, tokens, index):
+        if (not self._spaced(index)):
+            return Parser.FAIL
+        return Parse('whitespace', index)
+
 def main():
     parser = Parser()
 if __name__ == '__main__':
@@ -0,0 +1,62 @@
+import json
+import sys
+import timeit
+
+from parser import Parser
+
+# name -> (combinator call, input); every call starts from an empty memo so
+# each one does the combinator's work instead of a cache hit
+CASES = {
+    'choose hit': ('_choose', '12345', ('identifier', 'integer')),
+    'choose miss': ('_choose', '+', ('parenthesized_expression', 'function', 'identifier', 'integer')),
+    'zero_or_more': ('_zero_or_more', ' ' * 32 + 'x', ('whitespace',)),
+    'zero_or_more empty': ('_zero_or_more', 'x', ('whitespace',)),
+    'one_or_more': ('_one_or_more', ' \t\n' * 8 + 'x', ('whitespace',)),
+    'one_or_more miss': ('_one_or_more', 'x', ('whitespace',)),
+    'string_term hit': ('_string_term', 'while (x) {}', ('while',)),
+    'string_term miss': ('_string_term', 'whale (x) {}', ('while',)),
+    'choose_chars': ('_choose_chars', '>= 1', ('==', '!=', '<=', '>=', '<', '>')),
+    'character': ('_character', '+ 1', ('+',)),
+}
+
+def measure(number=20000, repeat=5):
+    """Return the best time of each case in nanoseconds per call."""
+    parser = Parser()
+    results = {}
+    for (name, (combinator, string, args)) in CASES.items():
+        method = getattr(parser, combinator)
+        def call():
+            parser._string = None
+            method(string, 0, *args)
+        best = min(timeit.repeat(call, number=number, repeat=repeat))
+        results[name] = best / number * 1e9
+    return results
+
+def compare(results, baseline, tolerance=0.1):
+    """Return the cases more than tolerance slower than in baseline."""
+    slower = []
+    for (name, time) in results.items():
+        if (name in baseline and time > baseline[name] * (1 + tolerance)):
+            slower.append((name, baseline[name], time))
+    return slower
+
+def main():
+    # python parser_bench.py [--save baseline.json] [--compare baseline.json]
+    args = sys.argv[1:]
+    results = measure()
+    for (name, time) in results.items():
+        print('%-20s %8.0f ns/call'%(name, time))
+    if ('--save' in args):
+        with open(args[args.index('--save') + 1], 'w') as file:
+            json.dump(results, file, indent=2)
+    if ('--compare' in args):
+        with open(args[args.index('--compare') + 1]) as file:
+            baseline = json.load(file)
+        slower = compare(results, baseline)
+        for (name, before, after) in slower:
+            print('regression: %s %.0f -> %.0f ns/call'%(name, before, after))
+        if (len(slower) > 0):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import time
+
+from parse import Parse
+
+class Profiler:
+    """Counts and times what the tree-walking Interpreter runs.
+
+    Node types get an execution count and the time spent in them minus the
+    time spent in the nodes they ran. Closures are keyed by the name they
+    were declared or assigned to and the source index of their function
+    (a line and column when the profiler has the source), and get a call
+    count, their time including nested calls, counted once however deep a
+    recursion goes, and their time excluding them. The self time of every
+    chain of calls is kept for collapsed-stack output.
+    """
+
+    def __init__(self, source=None, clock=time.perf_counter):
+        self.source = source
+        self.clock = clock
+        self.nodes = dict() # node type -> [executions, seconds]
+        self.closures = dict() # key -> [calls, seconds, seconds in the closure itself]
+        self.stacks = dict() # 'program;f@1:9;g@2:9' -> seconds in its innermost closure
+        self.calls = 0
+        self.max_depth = 0
+        self.__keys = dict() # id of a function body -> key
+        self.__functions = dict() # id of a function body -> (name, source index)
+        self.__active = dict() # key -> how many of its calls are running
+        self.__frames = [] # [node type, start, seconds in nested nodes] per running node
+        self.__calls = [] # [key, start, seconds in nested calls, stack] per running call
+
+    def start(self, program):
+        """Learn the functions of a program and start timing it."""
+        stack = [(program, 'func')]
+        while (len(stack) > 0):
+            (parse, name) = stack.pop()
+            if (not isinstance(parse, Parse)):
+                continue
+            if (parse.type == 'function'):
+                self.__functions[id(parse.children[-1])] = (name, parse.index)
+            name = 'func'
+            if (parse.type in ('declare', 'slot_declare')):
+                name = parse.children[-2] if parse.type == 'declare' else parse.children[1]
+            elif (parse.type == 'assign' and isinstance(parse.children[0], Parse)):
+                name = parse.children[0].children[0]
+            stack.extend((child, name) for child in parse.children)
+        self.__calls.append(['program', self.clock(), 0.0, 'program'])
+
+    def finish(self):
+        """Stop timing, closing whatever a runtime error left running."""
+        while (len(self.__frames) > 0):
+            self.leave()
+        while (len(self.__calls) > 1):
+            self.ret()
+        if (len(self.__calls) > 0):
+            (key, start, nested, stack) = self.__calls.pop()
+            self.stacks[stack] = self.stacks.get(stack, 0.0) + self.clock() - start - nested
+
+    def enter(self, parse):
+        self.__frames.append([parse.type, self.clock(), 0.0])
+
+    def leave(self):
+        (type, start, nested) = self.__frames.pop()
+        elapsed = self.clock() - start
+        entry = self.nodes.get(type)
+        if (entry is None):
+            entry = self.nodes[type] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += elapsed - nested
+        if (len(self.__frames) > 0):
+            self.__frames[-1][2] += elapsed
+
+    def __key(self, body):
+        key = self.__keys.get(id(body))
+        if (key is None):
+            (name, index) = self.__functions.get(id(body), ('func', body.index))
+            key = '%s@%s'%(name, self.position(index))
+            # functions the profiler cannot tell apart by position, as in a
+            # tree read from an S-expression, are numbered
+            if (key in self.closures):
+                key = '%s#%d'%(key, len([other for other in self.closures if other.startswith(key)]) + 1)
+            self.closures[key] = [0, 0.0, 0.0]
+            self.__keys[id(body)] = key
+        return key
+
+    def call(self, closure):
+        key = self.__key(closure.body())
+        stack = key
+        if (len(self.__calls) > 0):
+            stack = self.__calls[-1][3] + ';' + key
+        self.calls += 1
+        self.__active[key] = self.__active.get(key, 0) + 1
+        self.__calls.append([key, self.clock(), 0.0, stack])
+        self.max_depth = max(self.max_depth, len(self.__calls) - 1)
+
+    def ret(self):
+        (key, start, nested, stack) = self.__calls.pop()
+        elapsed = self.clock() - start
+        entry = self.closures[key]
+        entry[0] += 1
+        entry[2] += elapsed - nested
+        self.__active[key] -= 1
+        if (self.__active[key] == 0):
+            entry[1] += elapsed
+        self.stacks[stack] = self.stacks.get(stack, 0.0) + elapsed - nested
+        if (len(self.__calls) > 0):
+            self.__calls[-1][2] += elapsed
+
+    def position(self, index):
+        if (self.source is None):
+            return str(index)
+        line = self.source.count('\n', 0, index) + 1
+        column = index - self.source.rfind('\n', 0, index)
+        return '%d:%d'%(line, column)
+
+    def report(self, limit=20):
+        """Return the hottest node types and closures as a table."""
+        lines = ['%-24s %10s %10s'%('node type', 'count', 'self s')]
+        for (type, (count, seconds)) in sorted(self.nodes.items(), key=lambda item: -item[1][1])[:limit]:
+            lines.append('%-24s %10d %10.4f'%(type, count, seconds))
+        lines.append('')
+        lines.append('%-24s %10s %10s %10s'%('closure', 'calls', 'total s', 'self s'))
+        for (key, (calls, total, seconds)) in sorted(self.closures.items(), key=lambda item: -item[1][1])[:limit]:
+            lines.append('%-24s %10d %10.4f %10.4f'%(key, calls, total, seconds))
+        lines.append('')
+        lines.append('%d calls, max call depth %d'%(self.calls, self.max_depth))
+        return '\n'.join(lines)
+
+    def collapsed(self):
+        """Return the call stacks in the collapsed format flamegraph tools read.
+
+        Each line is a ';' separated stack and the microseconds spent in
+        its innermost frame.
+        """
+        lines = []
+        for (stack, seconds) in sorted(self.stacks.items()):
+            lines.append('%s %d'%(stack, round(seconds * 1e6)))
+        return '\n'.join(lines) + '\n'
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as file:
+            file.write(self.collapsed())
+
+def main():
+    import sys
+    from interpreter import Interpreter
+    from parser import Parser
+
+    source = 'var fib = func(n) {\n  if (n < 2) {\n    ret n;\n  }\n  ret fib(n - 1) + fib(n - 2);\n};\nvar adder = func(n) {\n  ret func(x) {\n    ret x + n;\n  };\n};\nvar i = 0;\nvar total = 0;\nwhile (i < 500) {\n  var add = adder(i);\n  total = add(total) - i;\n  i = i + 1;\n}\nprint fib(15);\nprint total;\n'
+    program = Parser(positions=True).parse(source, 'program')
+    profiler = Profiler(source)
+    print(Interpreter(profile=profiler).execute(program))
+    print(profiler.report())
+    if (len(sys.argv) > 1):
+        # python profiler.py out.folded; then flamegraph.pl out.folded > out.svg
+        profiler.write_collapsed(sys.argv[1])
+    else:
+        print(profiler.collapsed())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+from parse import Parse
+
+def declarations(body):
+    """Return the names a block declares, in order and without repeats.
+
+    Only the block's own statements declare into it; nested blocks and
+    function bodies have environments of their own.
+    """
+    statements = [body]
+    if (isinstance(body, Parse) and body.type == 'sequence'):
+        statements = body.children
+    names = []
+    for statement in statements:
+        if (not isinstance(statement, Parse)):
+            continue
+        if (statement.type == 'declare'):
+            var = statement.children[len(statement.children) - 2]
+        elif (statement.type == 'slot_declare'):
+            var = statement.children[1]
+        else:
+            continue
+        if (var not in names):
+            names.append(var)
+    return names
+
+def creates_closures(body):
+    """Return whether running body can capture its environment in a closure."""
+    stack = [body]
+    while (len(stack) > 0):
+        parse = stack.pop()
+        if (isinstance(parse, Parse)):
+            if (parse.type == 'function'):
+                return True
+            stack.extend(parse.children)
+    return False
+
+class Scope:
+    def __init__(self, parent, names, function=False):
+        self.parent = parent
+        self.names = names # every name declared in the scope, in slot order
+        self.declared = 0 # how many of them are declared at the current point
+        self.function = function # the scope is the environment of a closure call
+
+class Resolver:
+    """Rewrites a program so the interpreter finds variables by position.
+
+    lookup, varloc and declare nodes become slot_lookup, slot_varloc and
+    slot_declare nodes for ArrayEnvironment. A declaration's slot is the
+    position of its name among the declarations of its block. A variable
+    use gets the (depth, slot) addresses it can refer to, innermost first:
+    inside one function declarations happen in program order, so the
+    declaration in effect is known, but a closure body also sees names its
+    defining blocks declare after it was made, and those are only known to
+    exist once the call happens. The interpreter takes the first address
+    whose slot has been declared and raises UndefinedVariableError when
+    there is none, just like walking the environment chain by name.
+    """
+
+    def __init__(self, environment=None):
+        # names already declared in the global environment stay visible
+        self.__globals = list(environment.names()) if environment is not None else []
+
+    def resolve(self, parse):
+        scope = Scope(None, list(self.__globals))
+        scope.declared = len(scope.names)
+        self.__add_declarations(scope, parse)
+        return self._statement(parse, scope)
+
+    def __add_declarations(self, scope, body):
+        for var in declarations(body):
+            if (var not in scope.names):
+                scope.names.append(var)
+
+    def __addresses(self, var, scope):
+        addresses = []
+        depth = 0
+        later = False # declarations after this point may have happened by now
+        while (scope != None):
+            if (var in scope.names):
+                slot = scope.names.index(var)
+                if (slot < scope.declared):
+                    addresses.append((depth, slot))
+                    break
+                if (later):
+                    addresses.append((depth, slot))
+            later = later or scope.function
+            scope = scope.parent
+            depth += 1
+        return tuple(addresses)
+
+    def _statement(self, parse, scope):
+        if (not isinstance(parse, Parse)):
+            return parse
+        resolver = getattr(self, '_resolve_%s'%parse.type, None)
+        if (not callable(resolver)):
+            return Parse(parse.type, parse.index, *(self._statement(child, scope) for child in parse.children))
+        return resolver(parse, scope)
+
+    def _block(self, body, scope):
+        # the interpreter runs blocks that declare nothing in the enclosing
+        # environment, so they add no depth
+        if (len(declarations(body)) == 0):
+            return self._statement(body, scope)
+        inner = Scope(scope, [])
+        self.__add_declarations(inner, body)
+        return self._statement(body, inner)
+
+    def _resolve_lookup(self, parse, scope):
+        var = parse.children[0]
+        return Parse('slot_lookup', parse.index, var, self.__addresses(var, scope))
+
+    def _resolve_varloc(self, parse, scope):
+        var = parse.children[0]
+        return Parse('slot_varloc', parse.index, var, self.__addresses(var, scope))
+
+    def _resolve_declare(self, parse, scope):
+        type = 'var'
+        if (len(parse.children) == 3):
+            type = parse.children[0]
+        (var, value) = parse.children[-2:]
+        value = self._statement(value, scope)
+        slot = scope.names.index(var)
+        if (slot == scope.declared):
+            scope.declared += 1
+        return Parse('slot_declare', parse.index, type, var, slot, value)
+
+    def _resolve_while(self, parse, scope):
+        (cond, body) = parse.children
+        return Parse('while', parse.index, self._statement(cond, scope), self._block(body, scope))
+
+    def _resolve_if(self, parse, scope):
+        (cond, body) = parse.children
+        return Parse('if', parse.index, self._statement(cond, scope), self._block(body, scope))
+
+    def _resolve_ifelse(self, parse, scope):
+        (cond, body_if, body_else) = parse.children
+        return Parse('ifelse', parse.index, self._statement(cond, scope), self._block(body_if, scope), self._block(body_else, scope))
+
+    def _resolve_function(self, parse, scope):
+        children = list(parse.children)
+        params = children[-2].children
+        inner = Scope(scope, [], True)
+        for param in params:
+            if (param not in inner.names):
+                inner.names.append(param)
+        inner.declared = len(inner.names)
+        self.__add_declarations(inner, children[-1])
+        children[-1] = self._statement(children[-1], inner)
+        return Parse('function', parse.index, *children)
+
+def main():
+    from sexp import sexp
+    program = sexp('(sequence (declare x 1) (declare f (function (parameters a) (sequence (return (+ (lookup a) (lookup y)))))) (declare y 2) (while (lookup x) (sequence (declare z (lookup x)) (assign (varloc x) 0) (print (call (lookup f) (arguments (lookup z)))))))')
+    print(Resolver().resolve(program))
+
+if __name__ == '__main__':
+    main()
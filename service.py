@@ -0,0 +1,133 @@
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from errors import SyntaxError
+from interpreter import Interpreter
+from parser import Parser, TokenParser
+
+_worker = None # (Parser, Interpreter options) of a worker process
+
+def _start_worker(tokens, options):
+    global _worker
+    # the parser reports some of its work on stdout
+    sys.stdout = open(os.devnull, 'w')
+    _worker = (TokenParser() if tokens else Parser(), options)
+
+def _ready():
+    return os.getpid()
+
+def run_program(parser, options, source):
+    """Parse and run one program and return its output, or 'syntax error'."""
+    try:
+        parse = parser.parse(source, 'program')
+    except RecursionError:
+        parse = None
+    finally:
+        parser._string = None
+    if (parse is None):
+        return str(SyntaxError())
+    return Interpreter(**options).execute(parse)
+
+def run_batch(sources):
+    """Run a batch of programs in a worker process and return their outputs."""
+    (parser, options) = _worker
+    return [run_program(parser, options, source) for source in sources]
+
+class BatchService:
+    """Runs many independent programs on a pool of worker processes.
+
+    The workers start once, with the modules imported and a parser made,
+    and take programs in batches of batch_size to keep the cost of sending
+    them small. Each program gets a fresh Interpreter with the options
+    given, so max_steps and timeout limit every program on its own. Outputs
+    come back in the order the programs went in; at most window batches
+    per worker are waiting at a time, so programs can come from a stream
+    of any length. With tokens the workers parse with TokenParser.
+    """
+
+    def __init__(self, jobs=None, batch_size=16, window=4, tokens=False, **options):
+        # options are passed on to Interpreter, like vm, max_steps or timeout
+        self.jobs = jobs if jobs is not None else os.cpu_count()
+        self.batch_size = batch_size
+        self.__window = window * self.jobs
+        self.__pool = ProcessPoolExecutor(self.jobs, initializer=_start_worker, initargs=(tokens, options))
+        # workers are started on demand; asking every one of them for
+        # something starts them all now instead of during the first batch
+        for future in [self.__pool.submit(_ready) for i in range(self.jobs)]:
+            future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def close(self):
+        self.__pool.shutdown()
+
+    def run(self, sources):
+        """Yield the output of every program in sources, in order."""
+        pending = deque()
+        batch = []
+        for source in sources:
+            batch.append(source)
+            if (len(batch) < self.batch_size):
+                continue
+            pending.append(self.__pool.submit(run_batch, batch))
+            batch = []
+            while (len(pending) >= self.__window):
+                for output in pending.popleft().result():
+                    yield output
+        if (len(batch) > 0):
+            pending.append(self.__pool.submit(run_batch, batch))
+        while (len(pending) > 0):
+            for output in pending.popleft().result():
+                yield output
+
+    def map(self, sources):
+        """Return the outputs of a list of programs, in order."""
+        return list(self.run(sources))
+
+def programs(count):
+    """Return count small programs of a few kinds, no two the same."""
+    kinds = [
+        'var i = 0;\nvar s = 0;\nwhile (i < %d) {\n  s = s + i * 2 - i / 3;\n  i = i + 1;\n}\nprint s;\n',
+        'var fib = func(n) {\n  if (n < 2) {\n    ret n;\n  }\n  ret fib(n - 1) + fib(n - 2);\n};\nprint fib(%d / 100 + 8);\n',
+        'var adder = func(n) {\n  ret func(x) {\n    ret x + n;\n  };\n};\nvar i = 0;\nvar total = 0;\nwhile (i < %d) {\n  total = adder(i)(total) - i + 1;\n  i = i + 1;\n}\nprint total;\n',
+        'var x = %d;\nprint ((x + 1) * (x - 2) - (x * 3 + 4) / 5) * ((x - 6) / 7 + x * 8);\nprint 1 / (x - x);\n',
+    ]
+    return [kinds[i % len(kinds)]%(100 + i) for i in range(count)]
+
+def main():
+    import contextlib
+    import io
+
+    # python service.py [programs] [max jobs]; measures how throughput grows with jobs
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    most = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+    sources = programs(count)
+    parser = Parser()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = [run_program(parser, {'max_steps': 10 ** 6}, source) for source in sources]
+    single = time.perf_counter() - start
+    print('in this process: %.2fs, %.1f programs/s'%(single, count / single))
+    counts = [1]
+    while (counts[-1] * 2 <= most):
+        counts.append(counts[-1] * 2)
+    if (counts[-1] != most):
+        counts.append(most)
+    for jobs in counts:
+        with BatchService(jobs, max_steps=10 ** 6) as service:
+            start = time.perf_counter()
+            outputs = service.map(sources)
+            seconds = time.perf_counter() - start
+        assert outputs == expected
+        print('%2d jobs: %.2fs, %.1f programs/s, %.2fx'%(jobs, seconds, count / seconds, single / seconds))
+    print('%d cpus'%os.cpu_count())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import contextlib
+import io
+
+from compiler import Compiler
+from errors import SyntaxError
+from interpreter import Interpreter
+from output import Output
+from parser import Parser, TokenParser
+
+class Session:
+    """Runs programs one after another on the same global environment, like a REPL.
+
+    Every run sees the variables and functions declared by the runs before
+    it. The parse of each source, and in vm mode its bytecode, is kept for
+    the next time the same source is run, up to cache_size sources. The
+    global environment is copied before a run and put back when the run
+    stops with a runtime error, so a failed run declares and changes
+    nothing; variables of the functions it called are not copied, so a
+    closure the run changed before failing stays changed. In resolve and
+    native mode names are resolved a run at a time, so a function only
+    sees the globals declared before its run or in it. With tokens sources
+    are parsed with TokenParser.
+    """
+
+    def __init__(self, cache_size=256, tokens=False, **options):
+        # options are passed on to Interpreter, like vm or max_steps
+        self.__chunks = []
+        self.__vm = options.get('vm', False)
+        self.interpreter = Interpreter(output=Output(self.__chunks.append), **options)
+        self.__environment = self.interpreter.environment()
+        self.__parser = TokenParser() if tokens else Parser()
+        self.__programs = dict() # source -> what execute runs, or None for a syntax error
+        self.__cache_size = cache_size
+
+    def __compile(self, source):
+        # the parser reports some of its work on stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            program = self.__parser.parse(source, 'program')
+        self.__parser._string = None
+        if (program is not None and self.__vm):
+            program = Compiler().compile(program)
+        self.__programs[source] = program
+        if (len(self.__programs) > self.__cache_size):
+            del self.__programs[next(iter(self.__programs))]
+        return program
+
+    def run(self, source):
+        """Run source and return its output the way Interpreter.execute does."""
+        if (source in self.__programs):
+            program = self.__programs[source]
+        else:
+            program = self.__compile(source)
+        if (program is None):
+            return str(SyntaxError())
+        snapshot = self.__environment.snapshot()
+        self.interpreter.execute(program)
+        if (self.interpreter.error() is not None):
+            self.__environment.restore(snapshot)
+        text = ''.join(self.__chunks)
+        del self.__chunks[:]
+        return text[:-1]
+
+    def error(self):
+        """Return the runtime error that stopped the last run, or None."""
+        return self.interpreter.error()
+
+def main():
+    import time
+
+    session = Session()
+    for source in ['var count = 0;', 'var add = func(n) { count = count + n; ret count; };', 'print add(5);', 'var extra = 1;\nprint add(1 / 0);', 'print extra;', 'print add(2);', 'print count +;']:
+        print('> %s'%source.replace('\n', ' '))
+        print(session.run(source))
+    number = 10000
+    start = time.perf_counter()
+    for i in range(number):
+        session.run('print add(1);')
+    print('%.1fus per run of a cached snippet'%((time.perf_counter() - start) / number * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -1,92 +1,97 @@
 from parse import Parse
+import gc
 import re
 
-def normalize_sexp(string):
+# an S-expression is only parentheses and atoms, so one pattern splits it
+_TOKEN = re.compile(r'[()]|[^()\s]+')
 
-    def fail(index):
-        return None, index
+def _read(tokens):
+    # builds the value for a stream of tokens with an explicit stack, so
+    # nesting depth is not limited by the recursion limit. The tree has no
+    # cycles, so the cycle collector is paused while millions of nodes are made
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        stack = []
+        result = terms = []
+        for token in tokens:
+            if (token == '('):
+                stack.append(terms)
+                terms = []
+            elif (token == ')'):
+                if (len(stack) == 0 or len(terms) == 0 or not isinstance(terms[0], str)):
+                    raise SyntaxError('malformed S-expression')
+                value = Parse(terms[0], 0, *terms[1:])
+                terms = stack.pop()
+                terms.append(value)
+            elif (len(terms) == 0 and len(stack) > 0): # a title stays a string
+                terms.append(token)
+            elif (token.isnumeric()):
+                terms.append(int(token))
+            else:
+                terms.append(token)
+    finally:
+        if (enabled):
+            gc.enable()
+    if (len(stack) > 0 or len(result) > 1):
+        raise SyntaxError('malformed S-expression')
+    if (len(result) == 0):
+        return None
+    return result[0]
 
-    def skip_whitespace(string, index):
-        while index < len(string) and string[index] in ' \n':
-            index += 1
-        return index
+def _read_tokens(fd, chunk_size):
+    rest = ''
+    while True:
+        chunk = fd.read(chunk_size)
+        if (not chunk):
+            break
+        text = rest + chunk
+        tokens = _TOKEN.findall(text)
+        rest = ''
+        # an atom touching the end of the chunk may continue in the next one
+        if (len(tokens) > 0 and not (text[-1] in '()' or text[-1].isspace())):
+            rest = tokens.pop()
+        yield from tokens
+    if (rest != ''):
+        yield rest
 
-    def _normalize_sexp(string, index):
-        if index > len(string):
-            return fail(index)
-        index = skip_whitespace(string, index)
-        sexp = ''
-        if index < len(string) and string[index] == '(':
-            index = skip_whitespace(string, index + 1)
-            sexp += '('
-        match = re.match('[^() \n]+', string[index:])
-        if not match:
-            return fail(index)
-        if sexp == '':
-            return match.group(), index + len(match.group())
-        sexp = '(' + match.group()
-        index += len(match.group())
-        # match all children
-        while True:
-            index = skip_whitespace(string, index)
-            # match a child
-            child, index = _normalize_sexp(string, index)
-            if child is None:
-                break
-            sexp += ' ' + child
-        index = skip_whitespace(string, index)
-        if not string[index] == ')':
+def normalize_sexp(string):
+    tokens = _TOKEN.findall(string)
+    if (len(tokens) == 0):
+        return None
+    # check the shape without building the tree: balanced parentheses, every
+    # list starting with an atom and a single value at the top level
+    depth = 0
+    values = 0
+    previous = None
+    for token in tokens:
+        if (previous == '(' and token in '()'):
             raise SyntaxError('malformed S-expression')
-        sexp += ')'
-        index = skip_whitespace(string, index + 1)
-        return sexp, index
-
-    sexp, index = _normalize_sexp(string, 0)
-    if index == len(string):
-        return sexp
-    else:
+        if (depth == 0):
+            values += 1
+        if (token == '('):
+            depth += 1
+        elif (token == ')'):
+            depth -= 1
+            if (depth < 0):
+                raise SyntaxError('malformed S-expression')
+        previous = token
+    if (depth != 0 or values > 1):
         raise SyntaxError('malformed S-expression')
+    return ' '.join(tokens).replace('( ', '(').replace(' )', ')')
 
 def sexp(string, t=0):
     if (string == None):
         return None
-    string = normalize_sexp(string)
-    #print(f'{t*"  "}Parsing {string}')
-    if (string.isnumeric()): #Primitive
-        #print(f'{t*"  "}got numeric')
-        return int(string)
-    if (not ((')' in string) or ('(' in string))): #Term
-        #print(f'{t*"  "}got string')
-        return string
-    if (re.match('^[(](\S+)[)]$', string) != None): #Look for things of the form (arguments)
-        return Parse(string[1:-1],0)
-    match = re.search("^[(](\S+)[\s]+(.*)[)]$", string) #Matches things of the form (arguments a b c)
-    if (match == None):
-        return None
-    title = match.group(1)
-    rest = split_terms(match.group(2)).split('\n') # Uses a separator that wont show up in any terms
-    #print('%sTitle: %s, terms: %s'%(t*'  ',title, rest))
-    rest_parsed = [ sexp(term, t+1) for term in rest ]
-    #print('%sParsed Terms: %s isa %s'%(t*'  ',[str(p) for p in rest_parsed],[type(p) for p in rest_parsed]))
-    for parsed in rest_parsed:
-        if (parsed == None):
-            return None
-    return Parse(title, 0, *rest_parsed)
+    return _read(_TOKEN.findall(string))
+
+def read_sexp(fd, chunk_size=1 << 16):
+    """Read an S-expression from a file object without loading it all at once.
 
-def split_terms(string): # Split terms where \n separates terms
-    string = list(string)
-    pCount = 0
-    i = 0
-    while(i < len(string)):
-        if (string[i] == '('):
-            pCount += 1
-        if (string[i] == ')'):
-            pCount -= 1
-        if (string[i] == ' ' and pCount == 0):
-            string[i] = '\n'
-        i += 1
-    string = ''.join(string)
-    return string
+    The file is read in chunks of chunk_size characters and the result is the
+    same as sexp(fd.read()).
+    """
+    return _read(_read_tokens(fd, chunk_size))
 
 def print_parses(parse):
      if(isinstance(parse, Parse)):
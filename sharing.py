@@ -0,0 +1,123 @@
+from parse import Parse
+
+class SharedParse(Parse):
+    """A Parse node owned by a ParseTable.
+
+    A table holds one node per distinct (type, index, children), so two
+    nodes of the same table are structurally equal exactly when they are
+    the same object, and the hash is computed once when the node is made.
+    Shared nodes can be children of many parents, so they are immutable.
+    """
+
+    __slots__ = ('table', 'hash')
+
+    def __init__(self, table, type, index, children, hash):
+        set = object.__setattr__
+        kind = Parse.kind_of(type)
+        set(self, 'kind', kind)
+        set(self, 'index', index)
+        set(self, 'children', children)
+        set(self, 'table', table)
+        set(self, 'hash', hash)
+
+    def __setattr__(self, name, value):
+        raise TypeError('shared Parse nodes cannot be modified')
+
+    def __eq__(self, other):
+        if (isinstance(other, SharedParse) and other.table is self.table):
+            return self is other
+        return Parse.__eq__(self, other)
+
+    def __hash__(self):
+        return self.hash
+
+class ParseTable:
+    """Hash-consing table that makes structurally identical subtrees one object."""
+
+    def __init__(self):
+        self.__nodes = dict()
+        self.hits = 0 # requests answered with an existing node
+
+    def __len__(self):
+        return len(self.__nodes)
+
+    def owns(self, parse):
+        return isinstance(parse, SharedParse) and parse.table is self
+
+    def node(self, type, index, *children):
+        """Return the shared node with these fields.
+
+        Every child must be a leaf or a node of this table.
+        """
+        key = (Parse.kind_of(type), index, children)
+        node = self.__nodes.get(key)
+        if (node is None):
+            node = SharedParse(self, type, index, children, hash(key))
+            self.__nodes[key] = node
+        else:
+            self.hits += 1
+        return node
+
+    def share(self, parse):
+        """Return the shared copy of a whole tree, children before parents."""
+        if (not isinstance(parse, Parse) or self.owns(parse)):
+            return parse
+        shared = dict() # id of an original node -> its shared copy
+        stack = [(parse, False)]
+        while (len(stack) > 0):
+            (node, expanded) = stack.pop()
+            if (expanded):
+                children = tuple(shared[id(child)] if isinstance(child, Parse) and not self.owns(child) else child for child in node.children)
+                shared[id(node)] = self.node(node.type, node.index, *children)
+                continue
+            if (id(node) in shared):
+                continue
+            stack.append((node, True))
+            for child in node.children:
+                if (isinstance(child, Parse) and not self.owns(child)):
+                    stack.append((child, False))
+        return shared[id(parse)]
+
+def _count(parse):
+    # (nodes reached walking the tree, distinct node objects among them)
+    reached = 0
+    distinct = set()
+    stack = [parse]
+    while (len(stack) > 0):
+        node = stack.pop()
+        if (isinstance(node, Parse)):
+            reached += 1
+            distinct.add(id(node))
+            stack.extend(node.children)
+    return (reached, len(distinct))
+
+def main():
+    import contextlib
+    import io
+    import time
+    from interpreter import Interpreter
+    from parser import Parser
+    from transforms import ConstantFoldingTransform
+    # the transform checks for the classes of the imported module, not __main__
+    from sharing import ParseTable
+
+    block = 'var f%(i)d = func(n) {\n  var s = 0;\n  var i = 0;\n  while (i < n) {\n    s = s + (i + 1) * (2 * 3) - i / 2;\n    i = i + 1;\n  }\n  ret s;\n};\nprint f%(i)d(10) + 4 * 5;\n'
+    source = ''.join(block%{'i': i} for i in range(300))
+    for share in (None, ParseTable()):
+        with contextlib.redirect_stdout(io.StringIO()):
+            parse = Parser(share=share).parse(source, 'program')
+        (reached, distinct) = _count(parse)
+        print('%s: %d nodes in the tree, %d node objects'%('plain' if share is None else 'shared', reached, distinct))
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            folded = ConstantFoldingTransform().visit(parse)
+            folding = time.perf_counter() - start
+        print('  constant folding: %.3fs'%folding)
+        output = Interpreter().execute(folded)
+    table = ParseTable()
+    assert table.share(parse) is table.share(parse)
+    assert table.node('lookup', 0, 'i') == table.node('lookup', 0, 'i')
+    print(output.splitlines()[-1])
+
+if __name__ == '__main__':
+    main()
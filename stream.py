@@ -0,0 +1,149 @@
+import sys
+
+from errors import SyntaxError
+from interpreter import Interpreter
+from limits import Limits
+from output import Output
+from parse import Parse
+from parser import Parser
+
+class StatementReader(Parser):
+    """Parses a program from a file one top-level statement at a time.
+
+    The file is read in chunks and each program tail is parsed from the
+    text read so far. Every statement but an if ends with the ';' or '}'
+    that completes it, so once a tail is followed by more text than the
+    'else' an if looks for, and that text is neither an 'else' nor an
+    unfinished comment, reading further cannot change it. Only the text
+    after the last complete tail is kept. When a tail cannot be finished
+    yet, the next chunk read is as long as the text kept, so a statement is
+    parsed again only a logarithmic number of times however long it is.
+    It parses characters: TokenParser would need the whole text lexed first.
+    """
+
+    CHUNK = 1 << 16
+    LOOKAHEAD = len(' else')
+
+    def __init__(self, file, chunk=CHUNK):
+        super().__init__()
+        self.__file = file
+        self.__chunk = chunk
+        self.__text = ''
+        self.__position = 0
+        self.__end = False
+        self.offset = 0 # characters of the file before the text kept
+        self.error = None # a SyntaxError once the rest of the file does not parse
+
+    def __read(self, size):
+        data = self.__file.read(size)
+        self.offset += self.__position
+        self.__text = self.__text[self.__position:] + data
+        self.__position = 0
+        self.__end = len(data) == 0
+
+    def __complete(self, tail):
+        text = self.__text
+        if (self.__end):
+            return True
+        if (tail.index + StatementReader.LOOKAHEAD >= len(text)):
+            return False
+        return text[tail.index] != '#' and not text.startswith('else', tail.index)
+
+    def statements(self):
+        """Yield the normalized top-level statements of the file in order."""
+        self.__read(self.__chunk)
+        while True:
+            space = self._parse(self.__text, 'opt_space', 0)
+            if (self.__end or self.__complete(space)):
+                break
+            self.__read(max(self.__chunk, len(self.__text)))
+        self.__position = space.index
+        while True:
+            # like IncrementalParser, a memo per tail
+            self._cache = dict()
+            tail = self._parse(self.__text, 'program_tail', self.__position)
+            if (tail is not Parser.FAIL and self.__complete(tail)):
+                for statement in self._normalize(tail):
+                    yield statement
+                self.__position = tail.index
+            elif (self.__end):
+                break
+            else:
+                self.__read(max(self.__chunk, len(self.__text) - self.__position))
+        self._cache = dict()
+        # like Parser.parse, the last character may be left over
+        if (len(self.__text) - self.__position > 1):
+            self.error = SyntaxError()
+
+class ProgramLimits(Limits):
+    """Limits that count over every execute of a program run a statement at a time.
+
+    Interpreter.execute starts its limits again for every statement; these
+    start only the first time, so steps and the timeout add up over the
+    whole program.
+    """
+
+    def __init__(self, max_steps=None, timeout=None, max_depth=None):
+        super().__init__(max_steps, timeout, max_depth)
+        self.__started = False
+
+    def start(self):
+        if (not self.__started):
+            super().start()
+            self.__started = True
+
+class Stream:
+    """Runs a program while it is being read, one top-level statement at a time.
+
+    Every statement goes to the same Interpreter as soon as StatementReader
+    has parsed it, so output starts before the file is read to the end and
+    memory holds only the largest statement. Statements before a syntax
+    error have already run when it is found, and 'syntax error' follows
+    their output. Declarations are looked up by name as each statement
+    runs, so this uses the tree-walking interpreter; resolve and native
+    mode resolve names one statement at a time and do not see globals
+    declared after a function. max_steps and timeout limit the whole
+    program, not each statement.
+    """
+
+    def __init__(self, file, output=None, chunk=StatementReader.CHUNK, **options):
+        # options are passed on to Interpreter, like max_steps or profile; an
+        # Output made here is closed when run finishes
+        self.__owns_output = not isinstance(output, Output)
+        if (self.__owns_output):
+            output = Output(output)
+        self.__output = output
+        self.reader = StatementReader(file, chunk)
+        if (options.get('limits') is None and any(options.get(name) is not None for name in ('max_steps', 'timeout', 'max_depth'))):
+            options['limits'] = ProgramLimits(options.pop('max_steps', None), options.pop('timeout', None), options.pop('max_depth', None))
+        self.interpreter = Interpreter(output=output, **options)
+        self.statements = 0
+
+    def run(self):
+        """Run the file and return its output the way Interpreter.execute does."""
+        for statement in self.reader.statements():
+            self.interpreter.execute(Parse('sequence', 0, statement))
+            self.statements += 1
+            if (self.interpreter.error() is not None):
+                return self.__finish()
+        if (self.reader.error is not None):
+            self.__output.write(str(self.reader.error))
+        return self.__finish()
+
+    def __finish(self):
+        text = self.__output.text()
+        if (self.__owns_output):
+            self.__output.close()
+        return text
+
+def main():
+    # python stream.py [program.lang]; without a path the program is read from stdin
+    if (len(sys.argv) > 1 and sys.argv[1] != '-'):
+        with open(sys.argv[1]) as file:
+            Stream(file, sys.stdout).run()
+    else:
+        Stream(sys.stdin, sys.stdout).run()
+    sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
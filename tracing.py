@@ -0,0 +1,77 @@
+import collections
+
+def format_event(event):
+    """Render an interpreter event as the debug line it stands for.
+
+    Events are tuples of (depth, kind, *fields). Parses are kept as objects
+    and only turned into text here; environments and values (a pointer
+    prints its environment) are captured as text when the event is recorded
+    since they keep changing afterwards.
+    """
+    (depth, kind) = event[:2]
+    if (kind == 'interpreting'):
+        line = 'Interpreting %s'%event[2]
+    elif (kind == 'eval' or kind == 'exec'):
+        line = '%s %s with environment=%s'%(kind, event[2], event[3])
+    elif (kind == 'type'):
+        line = 'type: %s'%event[2]
+    elif (kind == 'got'):
+        line = 'got the %s %s'%(event[2], event[3])
+    else:
+        line = ' '.join(str(field) for field in event[1:])
+    return ('  '*depth) + line
+
+class ListSink:
+    """Keeps every event in memory."""
+
+    def __init__(self):
+        self.events = []
+        self.write = self.events.append
+
+    def text(self):
+        return '\n'.join(format_event(event) for event in self.events)
+
+class RingBufferSink:
+    """Keeps only the most recent size events."""
+
+    def __init__(self, size=1000):
+        self.events = collections.deque(maxlen=size)
+        self.write = self.events.append
+
+    def text(self):
+        return '\n'.join(format_event(event) for event in self.events)
+
+class FileSink:
+    """Writes each event as a line to a file object or a path."""
+
+    def __init__(self, file):
+        self.__owned = isinstance(file, str)
+        self.__file = open(file, 'w') if self.__owned else file
+
+    def write(self, event):
+        self.__file.write(format_event(event) + '\n')
+
+    def text(self):
+        return ''
+
+    def close(self):
+        if (self.__owned):
+            self.__file.close()
+        else:
+            self.__file.flush()
+
+def main():
+    import sys
+    from interpreter import Interpreter
+    from sexp import sexp
+
+    program = sexp('(sequence (declare a 2) (print (+ (lookup a) 3)))')
+    sink = RingBufferSink(4)
+    Interpreter(trace=sink).execute(program)
+    print('last %d events:'%len(sink.events))
+    print(sink.text())
+    print('as a file:')
+    Interpreter(trace=FileSink(sys.stdout)).execute(program)
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,13 @@
 from sexp import sexp
 from parse import Parse
+from sharing import SharedParse
 
 class ConstantFoldingTransform:
 
+    def __init__(self):
+        # results for shared subtrees, so each distinct subtree is folded once
+        self.__memo = dict()
+
     def is_add_sub(self, node):
         return isinstance(node, Parse) and node.type in '+-'
 
@@ -15,6 +20,13 @@ class ConstantFoldingTransform:
     def visit(self, node):
         if (isinstance(node, int)):
             return node
+        if (isinstance(node, SharedParse)):
+            if (node not in self.__memo):
+                self.__memo[node] = self.__visit(node)
+            return self.__memo[node]
+        return self.__visit(node)
+
+    def __visit(self, node):
         children = []
         for child in node.children:
             if self.is_statement(child):
@@ -41,7 +53,13 @@ class ConstantFoldingTransform:
 
 
             children.append(child)
-        node.children = children
+        if (isinstance(node, SharedParse)):
+            table = node.table
+            node = table.node(node.type, node.index, *(table.share(child) for child in children))
+        else:
+            # views like FlatParse and irfile's LazyParse have no children to
+            # replace, so the result is always a new node
+            node = Parse(node.type, node.index, *children)
         if self.is_mul_div(node):
             return self.mul_div_transform(node)
         else:
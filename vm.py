@@ -0,0 +1,241 @@
+from closure import Closure
+from compiler import *
+from environment import Environment
+from errors import *
+from parse import Parse
+from pointer import Pointer
+
+def _type(value):
+    # the same type names Interpreter uses for declarations and signatures
+    if (isinstance(value, Closure)):
+        return 'func'
+    if (isinstance(value, Pointer)):
+        return 'pointer'
+    if (isinstance(value, Parse)):
+        return 'parse'
+    if (isinstance(value, Environment)):
+        return 'environment'
+    return 'int'
+
+class VM:
+    """Stack machine that runs Code produced by Compiler.
+
+    Values live on a single stack and calls push a frame onto a list instead
+    of recursing, so the depth of a program's recursion is not tied to
+    Python's recursion limit.
+    """
+
+    def __init__(self, out, limits=None):
+        self.__out = out
+        # a limits.Limits counting loop iterations and calls as steps
+        self.__limits = limits
+
+    def run(self, code, environment=None):
+        if (environment is None):
+            environment = Environment()
+        out = self.__out
+        step = self.__limits.step if self.__limits is not None else None
+        enter = self.__limits.enter if self.__limits is not None else None
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        frames = []
+        instructions = code.instructions
+        pc = 0
+        env = environment
+        returning = False
+        value = 0
+        signature = None
+
+        while True:
+            op = instructions[pc]
+            arg = instructions[pc + 1]
+            pc += 2
+
+            if (op == LOOKUP):
+                scope = env
+                while (not scope.contains(arg)):
+                    # like Interpreter, only the innermost scope after a ret
+                    scope = scope.get_parent()
+                    if (scope == None or returning):
+                        raise UndefinedVariableError()
+                push(scope.get(arg))
+            elif (op == CONST):
+                push(arg)
+            elif (op == JUMP_IF_FALSE):
+                if (pop() == 0):
+                    pc = arg
+            elif (op == JUMP):
+                pc = arg
+            elif (op == LOOP):
+                # a step at the start of every iteration, like Interpreter
+                if (pop() == 0):
+                    pc = arg
+                elif (step is not None):
+                    step()
+            elif (op == ADD or op == SUB or op == MUL or op == DIV):
+                b = pop()
+                a = pop()
+                if (isinstance(a, Closure) or isinstance(b, Closure)):
+                    raise MathOperationOnFunctionError()
+                if (op == ADD):
+                    push(a + b)
+                elif (op == SUB):
+                    push(a - b)
+                elif (op == MUL):
+                    push(a * b)
+                else:
+                    if (b == 0):
+                        raise DivideByZeroError()
+                    push(int(a / b))
+            elif (op <= NEQ and op >= LT):
+                b = pop()
+                a = pop()
+                if ((a.__class__ is not int or b.__class__ is not int) and ((_type(a) != 'int') or (_type(b) != 'int'))):
+                    if (op == EQ):
+                        push(1 if a is b else 0)
+                    elif (op == NEQ):
+                        push(0 if a is b else 1)
+                    else:
+                        raise MathOperationOnFunctionError()
+                elif (op == LT):
+                    push(1 if a < b else 0)
+                elif (op == GT):
+                    push(1 if a > b else 0)
+                elif (op == LEQ):
+                    push(1 if a <= b else 0)
+                elif (op == GEQ):
+                    push(1 if a >= b else 0)
+                elif (op == EQ):
+                    push(1 if a == b else 0)
+                else:
+                    push(1 if a != b else 0)
+            elif (op == ASSIGN):
+                val = pop()
+                scope = env
+                while (not scope.contains(arg)):
+                    scope = scope.get_parent()
+                    if (scope == None):
+                        raise UndefinedVariableError()
+                type = scope.get_type(arg)
+                if (type not in ('var', _type(val))):
+                    raise TypeMismatchError()
+                scope.set(arg, val, type)
+            elif (op == PUSH_SCOPE):
+                env = Environment(env)
+            elif (op == POP_SCOPE):
+                env = env.get_parent()
+            elif (op == POP):
+                pop()
+            elif (op == PRINT):
+                out(pop())
+            elif (op == DECLARE):
+                val = pop()
+                (var, type) = arg
+                if (env.contains(var)):
+                    raise VariableAlreadyDefinedError()
+                if (type not in ('var', _type(val))):
+                    raise TypeMismatchError()
+                env.set(var, val, type)
+            elif (op == CHECK_CALL):
+                closure = stack[-1]
+                if (not isinstance(closure, Closure)):
+                    raise CallingNonFunctionError()
+                if (len(closure.params()) != arg):
+                    raise ArgumentMismatchError()
+            elif (op == ARG):
+                type = stack[-arg - 2].signature()[arg]
+                if (type != 'var' and type != _type(stack[-1])):
+                    raise TypeMismatchError()
+            elif (op == CALL):
+                if (step is not None):
+                    step()
+                    enter(len(frames) + 1)
+                start = len(stack) - arg
+                closure = stack[start - 1]
+                callee = closure.body()
+                func_environment = Environment(closure.environment())
+                for (param, val, type) in zip(callee.params, stack[start:], closure.signature()):
+                    func_environment.set(param, val, type)
+                del stack[start - 1:]
+                frames.append((instructions, pc, env, returning, value, signature))
+                instructions = callee.instructions
+                pc = 0
+                env = func_environment
+                returning = False
+                value = 0
+                signature = closure.signature()
+            elif (op == SET_RETURN):
+                value = pop()
+                returning = True
+            elif (op == RETURN):
+                if (signature[-1] != 'var' and signature[-1] != _type(value)):
+                    raise TypeMismatchError()
+                result = value
+                (instructions, pc, env, returning, value, signature) = frames.pop()
+                push(result)
+            elif (op == NOT):
+                val = pop()
+                if (isinstance(val, Closure) or val != 0):
+                    push(0)
+                else:
+                    push(1)
+            elif (op == JUMP_IF_TRUE):
+                val = pop()
+                if (isinstance(val, Closure) or val != 0):
+                    pc = arg
+            elif (op == FUNCTION):
+                if (arg.duplicate):
+                    raise DuplicateParameterError()
+                push(Closure(arg.params, arg, env, arg.signature))
+            elif (op == VARLOC):
+                scope = env
+                while (not scope.contains(arg)):
+                    scope = scope.get_parent()
+                    if (scope == None):
+                        raise UndefinedVariableError()
+                push(Pointer(scope, arg))
+            elif (op == ASSIGN_POINTER):
+                ptr = pop()
+                val = pop()
+                type = ptr.type()
+                if (type not in ('var', _type(val))):
+                    raise TypeMismatchError()
+                ptr.set(val)
+            elif (op == RAISE):
+                raise arg()
+            elif (op == HALT):
+                return
+            else:
+                raise AssertionError('Unexpected opcode %s'%op)
+
+def main():
+    import sys
+    import time
+    from interpreter import Interpreter
+    from parser import Parser
+
+    programs = {
+        'loop': 'var i = 0;\nvar total = 0;\nwhile (i < 500) {\n  total = total + i * 2 - i / 3;\n  if (total > 1000) { total = total - 1000; }\n  i = i + 1;\n}\nprint total;\n',
+        'calls': 'var fib = func(n) { if (n < 2) { ret n; } ret fib(n - 1) + fib(n - 2); };\nprint fib(14);\n',
+    }
+    for (name, source) in programs.items():
+        parse = Parser().parse(source, 'program')
+        start = time.perf_counter()
+        expected = Interpreter().execute(parse)
+        tree = time.perf_counter() - start
+        start = time.perf_counter()
+        actual = Interpreter(vm=True).execute(parse)
+        compiled = time.perf_counter() - start
+        assert actual == expected, '%s: %s != %s'%(name, actual, expected)
+        print('%-6s tree %.3fs  vm %.3fs  speedup %.1fx'%(name, tree, compiled, tree / compiled))
+
+    # recursion this deep overflows the tree interpreter's Python stack
+    depth = 1000000
+    parse = Parser().parse('var countdown = func(n) { if (n == 0) { ret 0; } ret countdown(n - 1); };\nprint countdown(%d);\n'%depth, 'program')
+    start = time.perf_counter()
+    output = Interpreter(vm=True).execute(parse)
+    print('countdown from %d: vm %.3fs, printed %s'%(depth, time.perf_counter() - start, output))
+
+if __name__ == '__main__':
+    main()